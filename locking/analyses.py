@@ -1,4 +1,3 @@
-import functools
 import itertools
 from collections import OrderedDict
 from . import colordict
@@ -16,8 +15,15 @@ import pycircstat as circ
 from datajoint import schema
 
 from locking.data import Runs, GlobalEFieldPeaksTroughs, peakdet, Cells, LocalEODPeaksTroughs, Baseline, \
-    GlobalEODPeaksTroughs, BaseEOD
+    GlobalEODPeaksTroughs, BaseEOD, add_columns
 from pycircstat import event_series as es
+from .peaks import coincident, combination_lattice, lattice_matches, COMBINATION_COEFFICIENTS
+from .blobcache import fetch_cached
+from .critical_values import poisson_threshold
+from .minimize import fminbound_batched
+from .profiling import Profiled
+from .spectra import vector_strength_spectrum, second_order_spectrum, mean_vector_strength, fft_frequencies
+from .spiketrains import SpikeTrains
 
 schema = schema('efish_analyses', locals())
 
@@ -29,10 +35,6 @@ def vector_strength_at(f, trial, alpha=None):
         return 1 - circ.var((trial % (1. / f)) * f * 2 * np.pi), np.sqrt(- np.log(alpha) / len(trial))
 
 
-def _neg_vs_at(f, spikes):
-    return -np.mean([1 - circ.var((trial % (1. / f)) * f * 2 * np.pi) for trial in spikes])
-
-
 def find_best_locking(spikes, f0, tol=3):
     """
     Locally searches for a maximum in vector strength for a collection of spikes.
@@ -44,13 +46,14 @@ def find_best_locking(spikes, f0, tol=3):
     * if all initial guesses are negative or positive, the search intervals are chosen such that the result is
       again negative or positive, respectively.
 
-    :param spikes: array of spike times or list thereof
+    :param spikes: array of spike times, list thereof, or SpikeTrains
     :param f0: list of initial guesses
     :param tol: search range is +-tol in Hz
     :return: best locking frequencies, corresponding vector strength
     """
-    max_w, max_v = [], []
-    if type(spikes) is not list:
+    if isinstance(spikes, SpikeTrains):
+        spikes = spikes.tolist()
+    elif type(spikes) is not list:
         spikes = [spikes]
 
     # at an initial and end value to fundamental to generate the search intervals
@@ -65,20 +68,35 @@ def find_best_locking(spikes, f0, tol=3):
     else:
         f0 = np.hstack((f0[0] - tol, f0, f0[-1] + tol))
 
-    for freq_before, freq, freq_after in zip(f0[:-2], f0[1:-1], f0[2:]):
-        # search in freq +- tol unless we get too close to another fundamental.
-        upper = min(freq + tol, (freq + freq_after) / 2)
-        lower = max(freq - tol, (freq_before + freq) / 2)
-        obj = functools.partial(_neg_vs_at, spikes=spikes)
-        f_opt = optimize.fminbound(obj, lower, upper)
-        max_w.append(f_opt)
-        max_v.append(-obj(f_opt))
+    # search in freq +- tol unless we get too close to another fundamental.
+    upper = np.minimum(f0[1:-1] + tol, (f0[1:-1] + f0[2:]) / 2)
+    lower = np.maximum(f0[1:-1] - tol, (f0[:-2] + f0[1:-1]) / 2)
 
-    return np.array(max_w), np.array(max_v)
+    # all intervals are refined at once with the steps of optimize.fminbound
+    trains = SpikeTrains.from_list(spikes)
+    max_w, _ = fminbound_batched(lambda f: -mean_vector_strength(trains, f), lower, upper)
+    max_v = mean_vector_strength(trains, max_w)
+
+    return max_w, max_v
 
 
 def find_significant_peaks(spikes, w, spectrum, peak_dict, threshold, tol=3.,
-                           upper_cutoff=2000):
+                           upper_cutoff=2000, coefficients=None):
+    """
+    Finds significant peaks in a vector strength spectrum and assigns them to integer combinations of the
+    frequencies in peak_dict.
+
+    :param spikes: array of spike times, list thereof, or SpikeTrains
+    :param w: frequencies of the spectrum
+    :param spectrum: vector strength spectrum
+    :param peak_dict: dictionary of coefficient name -> frequency
+    :param threshold: critical value of the vector strength
+    :param tol: tolerance in Hz within which a peak is assigned to a combination frequency
+    :param upper_cutoff: largest absolute frequency of peaks and combination frequencies
+    :param coefficients: multiples of the frequencies that are combined; either one array for all frequencies or
+                         a dictionary with one array per name in peak_dict. COMBINATION_COEFFICIENTS if None.
+    :return: list of dictionaries with the coefficients, frequency, vector strength, tolerance, and refined flag
+    """
     if not threshold > 0:
         print("Threshold value %.4f is not allowed" % threshold)
         return []
@@ -110,35 +128,88 @@ def find_significant_peaks(spikes, w, spectrum, peak_dict, threshold, tol=3.,
             print("\t\tAdjusting %s: %.2f --> %.2f" % (name, freq, max_w[idx]))
             peak_dict[name] = max_w[idx]
 
-    coeffs = [(name, peak_dict[name], np.arange(-5, 6)) for name in peak_dict]
-    coeff_names, coeff_f, coeff_facs = zip(*coeffs)
+    if coefficients is None:
+        coefficients = COMBINATION_COEFFICIENTS
+    coeff_names = list(peak_dict)
+    coeff_facs = [coefficients[name] if isinstance(coefficients, dict) else coefficients for name in coeff_names]
+    lattice, lattice_facs, position = combination_lattice([peak_dict[name] for name in coeff_names], coeff_facs,
+                                                          upper_cutoff)
+
+    # match unrefined and refined peaks against the lattice and order the matches like the loops over peaks and
+    # itertools.product of the coefficients, unrefined before refined
+    peaks = [(max_w, max_vs), (max_w_ref, max_vs_ref)]
+    matches = [lattice_matches(peak_w, lattice, tol) for peak_w, _ in peaks]
+    peak_idx = np.hstack([i for i, _ in matches])
+    lattice_idx = np.hstack([j for _, j in matches])
+    refined = np.hstack([np.full(len(i), r, dtype=int) for r, (i, _) in enumerate(matches)])
+    order = np.lexsort((refined, position[lattice_idx], peak_idx))
 
     ret = []
-
-    for maw, ma, maw_r, ma_r in zip(max_w, max_vs, max_w_ref, max_vs_ref):
-        for facs in itertools.product(*coeff_facs):
-            cur_freq = np.dot(facs, coeff_f)
-            if np.abs(cur_freq) > upper_cutoff:
-                continue
-
-            if np.abs(maw - cur_freq) < tol:
-                tmp = dict(zip(coeff_names, facs))
-                tmp['frequency'] = maw
-                tmp['vector_strength'] = ma
-                tmp['tolerance'] = tol
-                tmp['refined'] = 0
-                ret.append(tmp)
-
-            if np.abs(maw_r - cur_freq) < tol:
-                tmp = dict(zip(coeff_names, facs))
-                tmp['frequency'] = maw_r
-                tmp['vector_strength'] = ma_r
-                tmp['tolerance'] = tol
-                tmp['refined'] = 1
-                ret.append(tmp)
+    for i, j, r in zip(peak_idx[order], lattice_idx[order], refined[order]):
+        tmp = dict(zip(coeff_names, lattice_facs[j]))
+        tmp['frequency'] = peaks[r][0][i]
+        tmp['vector_strength'] = peaks[r][1][i]
+        tmp['tolerance'] = tol
+        tmp['refined'] = int(r)
+        ret.append(tmp)
     return ret
 
 
+def group_by_run(rows):
+    """
+    Groups fetched trials by the run they belong to.
+
+    :param rows: list of dictionaries that contain the primary key of Runs
+    :return: dictionary primary key of Runs as tuple -> list of rows in fetch order
+    """
+    runs = OrderedDict()
+    for row in rows:
+        runs.setdefault(tuple(row[k] for k in Runs().primary_key), []).append(row)
+    return runs
+
+
+class CellBatches:
+    """
+    Mixin for tables with one row per run that can populate all missing runs of a cell in one _make_tuples call.
+    Subclasses define the property run_source, the runs to populate, and the class attribute cell_parameters, the
+    lookup table that is part of their primary key besides Runs. If the class attribute per_cell is True, the keys
+    of populate are the cells with at least one missing run.
+    """
+    per_cell = False
+
+    @property
+    def key_source(self):
+        if self.per_cell:
+            return (Cells() * self.cell_parameters()).proj() & (self.run_source - self)
+        return self.run_source
+
+    @property
+    def target(self):
+        # populate subtracts the target from the key source, which at cell level would skip every cell with at
+        # least one populated run; the cell level key source only contains cells with missing runs anyway
+        return self & False if self.per_cell else self
+
+    def progress(self, *restrictions, display=True):
+        """
+        Like dj.Computed.progress, but counts runs instead of cells if per_cell is True.
+        """
+        if not self.per_cell:
+            return super().progress(*restrictions, display=display)
+        todo = self.run_source & dj.AndList(restrictions)
+        total = len(todo)
+        remaining = len(todo.proj() - self)
+        if display:
+            print('%-20s' % self.__class__.__name__, 'Completed %d of %d runs' % (total - remaining, total), flush=True)
+        return remaining, total
+
+    def missing_runs(self, key):
+        """
+        :param key: key of a run or of a cell
+        :return: runs of run_source within key that are not populated yet
+        """
+        return (self.run_source - self) & key
+
+
 class PlotableSpectrum:
     def plot(self, ax, restrictions, f_max=2000, ncol=None):
         sns.set_context('paper')
@@ -267,13 +338,26 @@ class SpectraParameters(dj.Lookup):
     spectra_setting     : tinyint   # index of the setting
     ---
     f_max               : float     # maximal frequency considered
+    engine="direct"     : enum('direct', 'chunked', 'nufft') # algorithm for 1st order spectra, see locking.spectra
+    tolerance=1e-8      : double    # accuracy of the nufft engine
     """
 
-    contents = [(0, 2000)]
+    contents = [(0, 2000, 'direct', 1e-8)]
+
+
+def migrate_spectra_parameters():
+    """
+    Adds the engine and tolerance attributes to a SpectraParameters table declared before they existed. Existing
+    settings keep the direct engine.
+    """
+    add_columns(SpectraParameters(), [
+        ('engine', 'enum("direct","chunked","nufft") NOT NULL DEFAULT "direct" '
+                   'COMMENT "algorithm for 1st order spectra, see locking.spectra"'),
+        ('tolerance', 'double NOT NULL DEFAULT 1e-8 COMMENT "accuracy of the nufft engine"')])
 
 
 @schema
-class TrialAlign(dj.Computed):
+class TrialAlign(Profiled, dj.Computed):
     definition = """
     # computes a time point where the EOD and the stimulus coincide
 
@@ -295,7 +379,7 @@ class TrialAlign(dj.Computed):
                  Runs.SpikeTimes() & key
 
         ep, sp = trials.fetch1['peaks', 'stim_peaks']
-        p0 = ep[np.abs(sp[:, None] - ep[None, :]).min(axis=0) <= tol * samplingrate] / samplingrate
+        p0 = ep[coincident(ep, sp, tol * samplingrate)] / samplingrate
         key['t0'] = p0.min()
         self.insert1(key)
 
@@ -304,11 +388,12 @@ class TrialAlign(dj.Computed):
         Loads aligned trials.
 
         :param restriction: restriction on Runs.SpikeTimes() * TrialAlign()
-        :returns: aligned trials; spike times are in seconds
+        :returns: aligned trials as SpikeTrains; spike times are in seconds
         """
 
-        trials = Runs.SpikeTimes() * TrialAlign() & restriction
-        return [s / 1000 - t0 for s, t0 in zip(*trials.fetch['times', 't0'])]
+        trials = fetch_cached(Runs.SpikeTimes() * TrialAlign() & restriction, 'times')
+        times, t0 = [trial['times'] for trial in trials], np.array([trial['t0'] for trial in trials])
+        return SpikeTrains.from_list(times).to_seconds().align(t0)
 
     def plot(self, ax, restriction):
         trials = self.load_trials(restriction)
@@ -329,13 +414,15 @@ class TrialAlign(dj.Computed):
 
         t = np.arange(0, 0.01, 1 / sampling_rate)
         n = len(t)
-        for geod, gef, t0 in zip(*trials.fetch['global_efield', 'global_voltage', 't0']):
+        for trial in fetch_cached(trials, 'global_efield', 'global_voltage'):
+            geod, gef = Runs.GlobalEField().load_trace(trial), Runs.GlobalEOD().load_trace(trial)
+            t0 = trial['t0']
             ax.plot(t - t0, geod[:n], '-', color='dodgerblue', lw=.1)
             ax.plot(t - t0, gef[:n], '-', color='k', lw=.1)
 
 
 @schema
-class FirstOrderSpikeSpectra(dj.Computed, PlotableSpectrum):
+class FirstOrderSpikeSpectra(Profiled, CellBatches, dj.Computed, PlotableSpectrum):
     definition = """
     # table that holds 1st order vector strength spectra
 
@@ -348,12 +435,17 @@ class FirstOrderSpikeSpectra(dj.Computed, PlotableSpectrum):
     critical_value          : float    # critical value for significance with alpha=0.001
     """
 
+    # populate all missing runs of a cell in one _make_tuples call with one fetch and one insert
+    per_cell = False
+    cell_parameters = SpectraParameters
+
     @property
-    def key_source(self):
+    def run_source(self):
         return Runs() * SpectraParameters() & TrialAlign() & dict(am=0)
 
     @staticmethod
-    def compute_1st_order_spectrum(aggregated_spikes, sampling_rate, duration, alpha=0.001, f_max=2000):
+    def compute_1st_order_spectrum(aggregated_spikes, sampling_rate, duration, alpha=0.001, f_max=2000,
+                                   engine='direct', tolerance=1e-8):
         """
         Computes the 1st order amplitue spectrum of the spike train (i.e. the vector strength spectrum
         of the aggregated spikes).
@@ -361,32 +453,44 @@ class FirstOrderSpikeSpectra(dj.Computed, PlotableSpectrum):
         :param aggregated_spikes: all spike times over all trials
         :param sampling_rate: sampling rate of the spikes
         :param alpha: significance level for the boundary against non-locking
+        :param engine: algorithm for the spectrum, one of locking.spectra.SPECTRUM_ENGINES
+        :param tolerance: accuracy of the nufft engine
         :returns: the frequencies for the vector strength spectrum, the spectrum, and the threshold against non-locking
 
         """
         if len(aggregated_spikes) < 2:
             return np.array([0]), np.array([0]), 0,
-        f = np.fft.fftfreq(int(duration * sampling_rate), 1 / sampling_rate)
-        f = f[(f >= -f_max) & (f <= f_max)]
-        v = es.direct_vector_strength_spectrum(aggregated_spikes, f)
+        n = int(duration * sampling_rate)
+        f = fft_frequencies(n, sampling_rate, f_max)
+        if engine == 'nufft':
+            v = vector_strength_spectrum(aggregated_spikes, f, engine, period=n / sampling_rate, tol=tolerance)
+        else:
+            v = vector_strength_spectrum(aggregated_spikes, f, engine)
         threshold = np.sqrt(- np.log(alpha) / len(aggregated_spikes))
         return f, v, threshold
 
     def _make_tuples(self, key):
-        print('Processing', key['cell_id'], 'run', key['run_id'], )
-        samplingrate, duration = (Runs() & key).fetch1['samplingrate', 'duration']
-        f_max = (SpectraParameters() & key).fetch1['f_max']
-
-        aggregated_spikes = np.hstack(TrialAlign().load_trials(key))
-        key['frequencies'], key['vector_strengths'], key['critical_value'] = \
-            self.compute_1st_order_spectrum(aggregated_spikes, samplingrate, duration, alpha=0.001, f_max=f_max)
-        vs = key['vector_strengths']
-        vs[np.isnan(vs)] = 0
-        self.insert1(key)
+        runs = self.missing_runs(key)
+        trials = group_by_run(fetch_cached(Runs.SpikeTimes() * TrialAlign() & runs.proj(), 'times'))
+        rows = []
+        for run in runs.fetch.as_dict():
+            print('Processing', run['cell_id'], 'run', run['run_id'], )
+            run_trials = trials.get(tuple(run[k] for k in Runs().primary_key), [])
+            aggregated_spikes = SpikeTrains.from_list([trial['times'] for trial in run_trials]).to_seconds() \
+                .align([trial['t0'] for trial in run_trials]).data
+            row = {k: run[k] for k in self.primary_key}
+            row['frequencies'], row['vector_strengths'], row['critical_value'] = \
+                self.compute_1st_order_spectrum(aggregated_spikes, run['samplingrate'], run['duration'],
+                                                alpha=0.001, f_max=run['f_max'], engine=run['engine'],
+                                                tolerance=run['tolerance'])
+            vs = row['vector_strengths']
+            vs[np.isnan(vs)] = 0
+            rows.append(row)
+        self.insert(rows)
 
 
 @schema
-class StimulusSpikeJitter(dj.Computed):
+class StimulusSpikeJitter(Profiled, dj.Computed):
     definition = """
     # circular variance and std of spike times within an EOD period during stimulation
 
@@ -413,8 +517,7 @@ class StimulusSpikeJitter(dj.Computed):
         else:
             eod = (Runs() & key).fetch1['eod']
 
-        aggregated_spikes = np.hstack(TrialAlign().load_trials(key))
-        aggregated_spikes %= 1 / eod
+        aggregated_spikes = TrialAlign().load_trials(key).fold(1 / eod).data
 
         aggregated_spikes *= eod * 2 * np.pi  # normalize to 2*pi
         if len(aggregated_spikes) > 1:
@@ -424,7 +527,7 @@ class StimulusSpikeJitter(dj.Computed):
 
 
 @schema
-class BaselineSpikeJitter(dj.Computed):
+class BaselineSpikeJitter(Profiled, dj.Computed):
     definition = """
     # circular variance and mean of spike times within an EOD period
 
@@ -459,7 +562,7 @@ class BaselineSpikeJitter(dj.Computed):
 
 
 @schema
-class SecondOrderSpikeSpectra(dj.Computed, PlotableSpectrum):
+class SecondOrderSpikeSpectra(Profiled, CellBatches, dj.Computed, PlotableSpectrum):
     definition = """
     # table that holds 2nd order vector strength spectra
     -> Runs                  # each run has a spectrum
@@ -471,12 +574,20 @@ class SecondOrderSpikeSpectra(dj.Computed, PlotableSpectrum):
     critical_value          : float    # critical value for significance with alpha=0.001
     """
 
+    # precision of the binned spike trains and their FFT; np.float32 about halves the peak memory of a batch
+    spectrum_dtype = np.float64
+
+    # populate all missing runs of a cell in one _make_tuples call with one fetch and one insert
+    per_cell = False
+    cell_parameters = SpectraParameters
+
     @property
-    def key_source(self):
+    def run_source(self):
         return Runs() * SpectraParameters() & dict(am=0)
 
     @staticmethod
-    def compute_2nd_order_spectrum(spikes, t, sampling_rate, alpha=0.001, method='poisson', f_max=2000):
+    def compute_2nd_order_spectrum(spikes, t, sampling_rate, alpha=0.001, method='poisson', f_max=2000,
+                                   dtype=np.float64):
         """
         Computes the 1st order amplitue spectrum of the spike train (i.e. the vector strength spectrum
         of the aggregated spikes).
@@ -487,29 +598,17 @@ class SecondOrderSpikeSpectra(dj.Computed, PlotableSpectrum):
         :param sampling_rate: sampling rate of the spikes
         :param alpha: significance level for the boundary against non-locking
         :param method: method to compute the confidence interval (poisson or gauss)
+        :param dtype: np.float64, or np.float32 to save memory for large runs
         :returns: the frequencies for the vector strength spectrum, the spectrum, and the threshold against non-locking
 
         """
 
         # compute 99% confidence interval for Null distribution of 2nd order spectra (no locking)
         spikes_per_trial = list(map(len, spikes))
-        # TODO convert to direct_vector_strength_spectrum with duration and frequencies
-        freqs, vs_spectra = zip(*[es.vector_strength_spectrum(sp, sampling_rate, time=t) for sp in spikes])
-
-        freqs = freqs[0]
-        m_ampl = np.mean(vs_spectra, axis=0)
+        freqs, m_ampl = second_order_spectrum(spikes, t, sampling_rate, f_max=f_max, dtype=dtype)
 
         if method == 'poisson':
-            poiss_rate = np.mean(spikes_per_trial)
-            r = np.linspace(0, 2, 10000)
-            dr = r[1] - r[0]
-            mu = np.sum(2 * poiss_rate * r ** 2 * np.exp(poiss_rate * np.exp(-r ** 2) - poiss_rate - r ** 2) / (
-                1 - np.exp(-poiss_rate))) * dr
-            s = np.sum(2 * poiss_rate * r ** 3 * np.exp(poiss_rate * np.exp(-r ** 2) - poiss_rate - r ** 2) / (
-                1 - np.exp(-poiss_rate))) * dr
-            s2 = np.sqrt(s - mu ** 2.)
-            y = stats.norm.ppf(1 - alpha, loc=mu,
-                               scale=s2 / np.sqrt(len(spikes_per_trial)))  # use central limit theorem
+            y = poisson_threshold(np.mean(spikes_per_trial), len(spikes_per_trial), alpha)
 
         elif method == 'gauss':
             n = np.asarray(spikes_per_trial)
@@ -519,26 +618,30 @@ class SecondOrderSpikeSpectra(dj.Computed, PlotableSpectrum):
             y = stats.norm.ppf(1 - alpha, loc=mu, scale=s)
         else:
             raise ValueError("Method %s not known" % (method,))
-        idx = (freqs >= -f_max) & (freqs <= f_max)
-        return freqs[idx], m_ampl[idx], y
+        return freqs, m_ampl, y
 
     def _make_tuples(self, key):
-        print('Processing', key['cell_id'], 'run', key['run_id'], )
-        dat = (Runs() & key).fetch(as_dict=True)[0]
-        dt = 1 / dat['samplingrate']
-        t = np.arange(0, dat['duration'], dt)
-        st = (Runs.SpikeTimes() & key).fetch(as_dict=True)
-        st = [s['times'] / 1000 for s in st if len(s) > 0]  # convert to s and drop empty trials
-        f_max = (SpectraParameters() & key).fetch1['f_max']
-
-        key['frequencies'], key['vector_strengths'], key['critical_value'] = \
-            SecondOrderSpikeSpectra.compute_2nd_order_spectrum(st, t, 1 / dt, alpha=0.001, method='poisson',
-                                                               f_max=f_max)
-        self.insert1(key)
+        runs = self.missing_runs(key)
+        trials = group_by_run(fetch_cached(Runs.SpikeTimes() & runs.proj(), 'times'))
+        grids = {}  # time grids shared by runs with the same duration and sampling rate
+        rows = []
+        for run in runs.fetch.as_dict():
+            print('Processing', run['cell_id'], 'run', run['run_id'], )
+            dt = 1 / run['samplingrate']
+            t = grids.setdefault((run['duration'], run['samplingrate']), np.arange(0, run['duration'], dt))
+            run_trials = trials.get(tuple(run[k] for k in Runs().primary_key), [])
+            st = SpikeTrains.from_list([trial['times'] for trial in run_trials]).to_seconds()
+
+            row = {k: run[k] for k in self.primary_key}
+            row['frequencies'], row['vector_strengths'], row['critical_value'] = \
+                SecondOrderSpikeSpectra.compute_2nd_order_spectrum(st, t, 1 / dt, alpha=0.001, method='poisson',
+                                                                   f_max=run['f_max'], dtype=self.spectrum_dtype)
+            rows.append(row)
+        self.insert(rows)
 
 
 @schema
-class FirstOrderSignificantPeaks(dj.Computed):
+class FirstOrderSignificantPeaks(Profiled, dj.Computed):
     definition = """
     # hold significant peaks in spektra
 
@@ -555,6 +658,8 @@ class FirstOrderSignificantPeaks(dj.Computed):
     tolerance               : double # tolerance within which a peak was accepted
     """
 
+    coefficients = COMBINATION_COEFFICIENTS  # multiples of stimulus, EOD, and baseline that are combined
+
     def _make_tuples(self, key):
         double_peaks = -1
         data = (FirstOrderSpikeSpectra() & key).fetch1()
@@ -568,13 +673,14 @@ class FirstOrderSignificantPeaks(dj.Computed):
         # st = (Runs.SpikeTimes() & key).fetch(as_dict=True)
         # spikes = np.hstack([s['times'] / 1000 - p['peaks'][0] * dt for s, p in zip(st, pt)])
         # spikes = np.hstack([s / 1000 - p[0] * dt for s, p in zip(*trials.fetch['times', 'peaks'])])
-        spikes = np.hstack(TrialAlign().load_trials(key))
+        spikes = TrialAlign().load_trials(key).data
         interesting_frequencies = {'stimulus_coeff': run['eod'] + run['delta_f'], 'eod_coeff': run['eod'],
                                    'baseline_coeff': cell['baseline']}
 
         f_max = (SpectraParameters() & key).fetch1['f_max']
         sas = find_significant_peaks(spikes, data['frequencies'], data['vector_strengths'],
-                                     interesting_frequencies, data['critical_value'], upper_cutoff=f_max)
+                                     interesting_frequencies, data['critical_value'], upper_cutoff=f_max,
+                                     coefficients=self.coefficients)
         for s in sas:
             s.update(key)
             try:
@@ -587,7 +693,7 @@ class FirstOrderSignificantPeaks(dj.Computed):
 
 
 @schema
-class SecondOrderSignificantPeaks(dj.Computed):
+class SecondOrderSignificantPeaks(Profiled, dj.Computed):
     definition = """
     # hold significant peaks in spektra
 
@@ -604,6 +710,8 @@ class SecondOrderSignificantPeaks(dj.Computed):
     tolerance               : double # tolerance within which a peak was accepted
     """
 
+    coefficients = COMBINATION_COEFFICIENTS  # multiples of stimulus, EOD, and baseline that are combined
+
     def _make_tuples(self, key):
         double_peaks = -1
         data = (SecondOrderSpikeSpectra() & key).fetch1()
@@ -612,14 +720,14 @@ class SecondOrderSignificantPeaks(dj.Computed):
 
         dt = 1 / run['samplingrate']
 
-        st = (Runs.SpikeTimes() & key).fetch(as_dict=True)
-        spikes = [s['times'] / 1000 for s in st]  # convert to s
+        _, spikes = (Runs() & key).load_spikes()
 
         interesting_frequencies = {'stimulus_coeff': run['eod'] + run['delta_f'], 'eod_coeff': run['eod'],
                                    'baseline_coeff': cell['baseline']}
         f_max = (SpectraParameters() & key).fetch1['f_max']
         sas = find_significant_peaks(spikes, data['frequencies'], data['vector_strengths'],
-                                     interesting_frequencies, data['critical_value'], upper_cutoff=f_max)
+                                     interesting_frequencies, data['critical_value'], upper_cutoff=f_max,
+                                     coefficients=self.coefficients)
         for s in sas:
             s.update(key)
 
@@ -646,7 +754,7 @@ class SamplingPointsPerBin(dj.Lookup):
 
 
 @schema
-class PhaseLockingHistogram(dj.Computed):
+class PhaseLockingHistogram(Profiled, dj.Computed):
     definition = """
     # phase locking histogram at significant peaks
 
@@ -692,7 +800,7 @@ class PhaseLockingHistogram(dj.Computed):
             peaks = (GlobalEFieldPeaksTroughs() & key).fetch['peaks']
         # spikes = np.hstack([s / 1000 - p[0] / samplingrate for s, p in zip(times, peaks)])
 
-        spikes = np.hstack(TrialAlign().load_trials(key))
+        spikes = TrialAlign().load_trials(key).data
         key['peak_frequency'] = samplingrate / np.mean([np.diff(p).mean() for p in peaks])
         key['locking_frequency'] = locking_frequency
 
@@ -734,7 +842,7 @@ class PhaseLockingHistogram(dj.Computed):
 
 
 @schema
-class EODStimulusPSTSpikes(dj.Computed):
+class EODStimulusPSTSpikes(Profiled, dj.Computed):
     definition = """
     # PSTH of Stimulus and EOD at the difference frequency of both
 
@@ -771,13 +879,12 @@ class EODStimulusPSTSpikes(dj.Computed):
 
             whs = 10 * eod_period
 
-            times, peaks, epeaks, global_eod = \
-                (Runs.SpikeTimes() * GlobalEODPeaksTroughs() * Runs.LocalEOD() \
-                 * GlobalEFieldPeaksTroughs().proj(epeaks='peaks') \
-                 & key).fetch['times', 'peaks', 'epeaks', 'local_efield']
+            trials = fetch_cached(Runs.SpikeTimes() * GlobalEODPeaksTroughs() * Runs.LocalEOD()
+                                  * GlobalEFieldPeaksTroughs().proj(epeaks='peaks') & key, 'times', 'local_efield')
+            times, peaks, epeaks = ([trial[k] for trial in trials] for k in ('times', 'peaks', 'epeaks'))
+            global_eod = [Runs.LocalEOD().load_trace(trial) for trial in trials]
 
-            p0 = [peaks[i][
-                      np.abs(epeaks[i][:, None] - peaks[i][None, :]).min(axis=0) <= tol * samplingrate] / samplingrate
+            p0 = [peaks[i][coincident(peaks[i], epeaks[i], tol * samplingrate)] / samplingrate
                   for i in range(len(peaks))]
 
             spikes, eod, field = [], [], []
@@ -790,7 +897,10 @@ class EODStimulusPSTSpikes(dj.Computed):
                     chunk = train[(train >= phase - whs) & (train <= phase + whs)] - phase
                     if len(chunk) > 0:
                         spikes.append(chunk)
-                        field.append(np.interp(sampl_times + phase, t, eftrain))
+                        # only the window around the peak is read from the trace
+                        lo = max(int(np.floor((phase - whs) * samplingrate)) - 1, 0)
+                        hi = int(np.ceil((phase + whs) * samplingrate)) + 2
+                        field.append(np.interp(sampl_times + phase, t[lo:hi], eftrain[lo:hi]))
 
             key['eod_frequency'] = runs_eod.fetch1['frequency']
             key['vector_strength_eod'] = runs_eod.fetch1['vector_strength']
@@ -929,7 +1039,7 @@ class SignificanceLevel(dj.Lookup):
 
 
 @schema
-class Decoding(dj.Computed):
+class Decoding(Profiled, CellBatches, dj.Computed):
     definition = """
     # locking by decoding time
 
@@ -958,31 +1068,40 @@ class Decoding(dj.Computed):
         vs_stimulus=null             : float # vector strength for full trial
         """
 
+    # populate all missing runs of a cell in one _make_tuples call with one fetch and one insert per table
+    per_cell = False
+    cell_parameters = SignificanceLevel
+
     @property
-    def key_source(self):
+    def run_source(self):
         return Runs() * SignificanceLevel() * Cells() & dict(cell_type='p-unit')
 
     def _make_tuples(self, key):
-        print('Processing', key['cell_id'], 'run', key['run_id'], )
-        dat = (Runs() & key).fetch(as_dict=True)[0]
-
-        spike_times, trial_ids = (Runs.SpikeTimes() & key).fetch['times', 'trial_id']
-        spike_times = [s / 1000 for s in spike_times]  # convert to s
-
-        # refine delta f locking on all spikes
-        delta_f = find_best_locking(spike_times, [dat['delta_f']], tol=3)[0][0]
-        stimulus_frequency = find_best_locking(spike_times, [dat['delta_f'] + dat['eod']], tol=3)[0][0]
-
-        self.insert1(dict(key, beat=delta_f, stimulus=stimulus_frequency))
-        stim = self.Stimulus()
-        beat = self.Beat()
-        for key['trial_id'], trial in zip(trial_ids, spike_times):
-            v, c = vector_strength_at(stimulus_frequency, trial, alpha=key['alpha'])
-            if np.isinf(c):
-                c = np.NaN
-            stim.insert1(dict(key, vs_stimulus=v, crit_stimulus=c))
-            v, c = vector_strength_at(delta_f, trial, alpha=key['alpha'])
-            if np.isinf(c):
-                c = np.NaN
-            beat.insert1(dict(key, vs_beat=v, crit_beat=c))
+        runs = self.missing_runs(key)
+        trials = group_by_run(fetch_cached(Runs.SpikeTimes() & runs.proj(), 'times'))
+        rows, stim, beat = [], [], []
+        for dat in runs.fetch.as_dict():
+            print('Processing', dat['cell_id'], 'run', dat['run_id'], )
+            run_trials = trials.get(tuple(dat[k] for k in Runs().primary_key), [])
+            trial_ids = [trial['trial_id'] for trial in run_trials]
+            spike_times = SpikeTrains.from_list([trial['times'] for trial in run_trials]).to_seconds()
+
+            # refine delta f locking on all spikes
+            delta_f = find_best_locking(spike_times, [dat['delta_f']], tol=3)[0][0]
+            stimulus_frequency = find_best_locking(spike_times, [dat['delta_f'] + dat['eod']], tol=3)[0][0]
+
+            run_key = {k: dat[k] for k in self.primary_key}
+            rows.append(dict(run_key, beat=delta_f, stimulus=stimulus_frequency))
+            for trial_id, trial in zip(trial_ids, spike_times):
+                v, c = vector_strength_at(stimulus_frequency, trial, alpha=dat['alpha'])
+                if np.isinf(c):
+                    c = np.NaN
+                stim.append(dict(run_key, trial_id=trial_id, vs_stimulus=v, crit_stimulus=c))
+                v, c = vector_strength_at(delta_f, trial, alpha=dat['alpha'])
+                if np.isinf(c):
+                    c = np.NaN
+                beat.append(dict(run_key, trial_id=trial_id, vs_beat=v, crit_beat=c))
+        self.insert(rows)
+        self.Stimulus().insert(stim)
+        self.Beat().insert(beat)
 
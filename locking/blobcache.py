@@ -0,0 +1,197 @@
+"""
+Local on-disk cache for longblob attributes, e.g. the spike times and traces in the part tables of Runs.
+
+Blobs are addressed by the MD5 of their packed content, which MySQL computes on the server. A fetch through the
+cache therefore only transfers 32 bytes per blob if the content is already cached. A row that is replaced or
+updated gets a new MD5, so a stale entry is never read again; it is eventually removed by the LRU eviction.
+
+Example::
+
+    trials = fetch_cached(Runs.SpikeTimes() * TrialAlign() & key, 'times')
+    print(get_cache().stats())
+"""
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+CACHEDIR = os.path.expanduser('~/.cache/locking/blobs')
+CACHE_MAX_BYTES = 8 * 2 ** 30
+EVICT_TO = 0.9  # eviction shrinks the cache to this fraction of max_bytes, so that it is rarely rescanned
+FETCH_CHUNK_SIZE = 500  # number of keys per query for the blobs that are not cached
+
+
+class BlobCache:
+    """
+    Content-addressed store of unpacked blobs in a directory, bounded to max_bytes by evicting the least recently
+    used entries down to EVICT_TO * max_bytes. Entries are written atomically, so several processes can share the
+    directory.
+
+    :param cachedir: directory of the cache, CACHEDIR if None
+    :param max_bytes: maximal size of the cache on disk, CACHE_MAX_BYTES if None
+    """
+
+    def __init__(self, cachedir=None, max_bytes=None):
+        self.cachedir = CACHEDIR if cachedir is None else cachedir
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self._size = None  # bytes on disk, determined on the first put
+
+    def stats(self):
+        """
+        :return: dictionary with hits, misses, hit rate, evictions, and size on disk
+        """
+        total = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, hit_rate=self.hits / total if total > 0 else np.nan,
+                    evictions=self.evictions, bytes=self._size if self._size is not None else self.size())
+
+    def _path(self, digest, extension):
+        return os.path.join(self.cachedir, digest[:2], digest + extension)
+
+    def get(self, digest):
+        """
+        Looks up a blob and marks it as recently used.
+
+        :param digest: MD5 of the packed blob
+        :return: found, value
+        """
+        for extension in ('.npy', '.pkl'):
+            path = self._path(digest, extension)
+            try:
+                if extension == '.npy':
+                    value = np.load(path, allow_pickle=False)
+                else:
+                    with open(path, 'rb') as fid:
+                        value = pickle.load(fid)
+                os.utime(path)
+            except (FileNotFoundError, EOFError):  # not cached, or evicted by another process
+                continue
+            self.hits += 1
+            return True, value
+        self.misses += 1
+        return False, None
+
+    def put(self, digest, value):
+        """
+        Stores a blob and evicts least recently used blobs if the cache gets larger than max_bytes.
+
+        :param digest: MD5 of the packed blob
+        :param value: unpacked blob
+        """
+        array = isinstance(value, np.ndarray) and not value.dtype.hasobject
+        path = self._path(digest, '.npy' if array else '.pkl')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fid:
+            if array:
+                np.save(fid, value, allow_pickle=False)
+            else:
+                pickle.dump(value, fid, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        if not os.path.isdir(self.cachedir):
+            return []
+        entries = []
+        for sub in os.scandir(self.cachedir):
+            if sub.is_dir():
+                entries.extend(e for e in os.scandir(sub.path) if not e.name.endswith('.tmp'))
+        return entries
+
+    def size(self):
+        """
+        :return: size of the cache on disk in bytes
+        """
+        return sum(e.stat().st_size for e in self._entries())
+
+    def evict(self):
+        """
+        Removes the least recently used blobs until the cache is smaller than EVICT_TO * max_bytes.
+        """
+        entries = []
+        for e in self._entries():
+            try:
+                st = e.stat()
+            except FileNotFoundError:  # evicted by another process
+                continue
+            entries.append((st.st_mtime, st.st_size, e.path))
+        entries.sort()
+        size = sum(s for _, s, _ in entries)
+        for _, s, path in entries:
+            if size <= EVICT_TO * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= s
+            self.evictions += 1
+        self._size = size
+
+    def clear(self):
+        """
+        Removes all blobs.
+        """
+        for e in self._entries():
+            os.remove(e.path)
+        self._size = 0
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    :return: the BlobCache of this process, created on first use
+    """
+    global _cache
+    if _cache is None:
+        _cache = BlobCache()
+    return _cache
+
+
+def fetch_cached(rel, *attributes, cache=None):
+    """
+    Fetches a relation like rel.fetch.as_dict(), but the blob attributes are read from the local cache if their
+    content is already cached and only fetched from the database otherwise.
+
+    :param rel: relation, e.g. Runs.SpikeTimes() & key or a join with it
+    :param attributes: names of the blob attributes that go through the cache
+    :param cache: BlobCache, get_cache() if None
+    :return: list of dictionaries with all attributes of rel
+    """
+    cache = get_cache() if cache is None else cache
+    digests = {a: '_md5_' + a for a in attributes}
+    others = [a for a in rel.heading.names if a not in rel.primary_key and a not in attributes]
+    rows = rel.proj(*others, **{d: 'MD5(`%s`)' % a for a, d in digests.items()}).fetch.as_dict()
+
+    for a, d in digests.items():
+        missing = []
+        for row in rows:
+            found, row[a] = cache.get(row[d]) if row[d] is not None else (True, None)
+            if not found:
+                missing.append(row)
+        for start in range(0, len(missing), FETCH_CHUNK_SIZE):
+            chunk = missing[start:start + FETCH_CHUNK_SIZE]
+            keys = [{k: row[k] for k in rel.primary_key} for row in chunk]
+            # the digest is fetched again with the blob, in case the row was replaced in the meantime
+            fetched = {r[d]: r[a] for r in (rel & keys).proj(a, **{d: 'MD5(`%s`)' % a}).fetch.as_dict()}
+            for row in chunk:
+                if row[d] in fetched:
+                    row[a] = fetched[row[d]]
+                else:  # replaced in the meantime, take what is in the database now
+                    row[a] = (rel & {k: row[k] for k in rel.primary_key}).fetch1[a]
+            for digest, value in fetched.items():
+                cache.put(digest, value)
+    for row in rows:
+        for d in digests.values():
+            del row[d]
+    return rows
@@ -0,0 +1,114 @@
+"""
+Critical values of the 2nd order vector strength (mean vector strength over trials) under the null hypothesis of
+Poisson distributed spike counts per trial and uniformly distributed spike phases.
+
+The mean and standard deviation of the vector strength of one trial are numerical integrals over the resultant
+vector length, which only depend on the Poisson rate. The critical value for n trials then follows from the
+central limit theorem.
+
+Example::
+
+    threshold = poisson_threshold(np.mean(spikes_per_trial), len(spikes_per_trial), alpha=0.001)
+    thresholds = interpolated_poisson_thresholds(rates, n_trials, alpha=0.001)
+"""
+from functools import lru_cache
+
+import numpy as np
+from scipy import stats
+
+INTEGRATION_POINTS = 10000  # points of the Riemann sum over the resultant vector length in [0, 2]
+INTEGRATION_BLOCK = 256  # number of rates integrated at once by poisson_moments
+CACHE_SIZE = 4096
+RATE_GRID = np.geomspace(0.1, 10000, 2049)  # rates of the interpolation table
+
+
+def poisson_moments(rates):
+    """
+    Mean and standard deviation of the vector strength of a single trial with a Poisson number of uniformly
+    distributed spike phases.
+
+    :param rates: Poisson rate (mean number of spikes per trial) or array thereof
+    :return: mean, standard deviation with the shape of rates
+    """
+    rates = np.asarray(rates, dtype=np.float64)
+    flat = rates.ravel()
+    r = np.linspace(0, 2, INTEGRATION_POINTS)
+    dr = r[1] - r[0]
+    mu, s = np.empty(len(flat)), np.empty(len(flat))
+    for start in range(0, len(flat), INTEGRATION_BLOCK):
+        poiss_rate = flat[start:start + INTEGRATION_BLOCK, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            density = 2 * poiss_rate * r ** 2 * np.exp(poiss_rate * np.exp(-r ** 2) - poiss_rate - r ** 2) / (
+                1 - np.exp(-poiss_rate))
+        mu[start:start + INTEGRATION_BLOCK] = np.sum(density, axis=1) * dr
+        s[start:start + INTEGRATION_BLOCK] = np.sum(density * r, axis=1) * dr
+    with np.errstate(invalid='ignore'):
+        s2 = np.sqrt(s - mu ** 2.)
+    return mu.reshape(rates.shape), s2.reshape(rates.shape)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _poisson_threshold(rate, n_trials, alpha):
+    mu, s2 = poisson_moments(rate)
+    return float(stats.norm.ppf(1 - alpha, loc=mu, scale=s2 / np.sqrt(n_trials)))  # use central limit theorem
+
+
+def poisson_threshold(rate, n_trials, alpha=0.001):
+    """
+    Critical value of the mean vector strength over n_trials trials with Poisson spike counts. Results are
+    memoized by (rate, n_trials, alpha).
+
+    :param rate: mean number of spikes per trial
+    :param n_trials: number of trials
+    :param alpha: significance level
+    :return: critical value
+    """
+    return _poisson_threshold(float(rate), int(n_trials), float(alpha))
+
+
+def poisson_thresholds(rates, n_trials, alpha=0.001):
+    """
+    Critical values for arrays of rates and numbers of trials, computed by the integral for every rate.
+
+    :param rates: mean numbers of spikes per trial
+    :param n_trials: numbers of trials, broadcast against rates
+    :param alpha: significance level
+    :return: critical values with the broadcast shape of rates and n_trials
+    """
+    mu, s2 = poisson_moments(rates)
+    return stats.norm.ppf(1 - alpha, loc=mu, scale=s2 / np.sqrt(n_trials))
+
+
+@lru_cache(maxsize=1)
+def poisson_table():
+    """
+    Mean and standard deviation of the single-trial vector strength at the rates in RATE_GRID, computed on
+    first use.
+
+    :return: rates, means, standard deviations
+    """
+    mu, s2 = poisson_moments(RATE_GRID)
+    return RATE_GRID, mu, s2
+
+
+def interpolated_poisson_thresholds(rates, n_trials, alpha=0.001):
+    """
+    Critical values for arrays of rates and numbers of trials, with the moments linearly interpolated over the
+    logarithm of the rate from poisson_table. Rates outside of RATE_GRID are integrated directly.
+
+    :param rates: mean numbers of spikes per trial
+    :param n_trials: numbers of trials, broadcast against rates
+    :param alpha: significance level
+    :return: critical values with the broadcast shape of rates and n_trials
+    """
+    grid, mu_grid, s2_grid = poisson_table()
+    rates = np.asarray(rates, dtype=np.float64)
+    inside = (rates >= grid[0]) & (rates <= grid[-1])
+    mu, s2 = np.empty(rates.shape), np.empty(rates.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_rates = np.log(rates[inside])
+    mu[inside] = np.interp(log_rates, np.log(grid), mu_grid)
+    s2[inside] = np.interp(log_rates, np.log(grid), s2_grid)
+    if not np.all(inside):
+        mu[~inside], s2[~inside] = poisson_moments(rates[~inside])
+    return stats.norm.ppf(1 - alpha, loc=mu, scale=s2 / np.sqrt(n_trials))
@@ -1,7 +1,9 @@
+import hashlib
 import os
 import re
+from glob import glob
 from itertools import count
-from . import colordict
+from . import colordict, mkdir
 import datajoint as dj
 import datajoint as dj
 import sys
@@ -9,10 +11,14 @@ import yaml
 import seaborn as sns
 
 BASEDIR = '/data/'
+TRACEDIR = BASEDIR + 'traces/'  # target directory of migrate_traces
 schema = dj.schema('efish_data', locals())
-from pyrelacs.DataClasses import load, TraceFile
+from .blobcache import fetch_cached
+from . import relacs
+from .relacs import load, load_tracefile, read_info
+relacs.CACHEDIR = BASEDIR + 'relacs_cache/'  # parsed relacs files, shared by all populate processes
+from .profiling import Profiled
 import numpy as np
-from pint import UnitRegistry
 import pycircstat as circ
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -20,69 +26,21 @@ import seaborn as sns
 import statsmodels.api as sm
 from statsmodels.formula.api import ols
 import pickle
+from .peaks import peakdet
+from .units import get_number_and_unit, convert_to
+from .spiketrains import SpikeTrains
 
-ureg = UnitRegistry()
+# maximal payload of a single batched insert in bytes; must stay below max_allowed_packet of the server
+MAX_INSERT_BYTES = 64 * 2 ** 20
 
-
-def peakdet(v, delta=None):
-    """
-    Peak detection. Modified version from https://gist.github.com/endolith/250860
-
-    A point counts as peak if it is maximal and is preceeded by a value lower by delta.
-
-    :param v: array of values
-    :param delta: threshold; set to 99.9%ile - median of v if None
-    :return: maxima, maximum indices, minima, minimum indices
-    """
-    maxtab = []
-    maxidx = []
-
-    mintab = []
-    minidx = []
-    v = np.asarray(v)
-    if delta is None:
-        up = int(np.min([1e5, len(v)]))
-        tmp = np.abs(v[:up])
-        delta = np.percentile(tmp, 99.9) - np.percentile(tmp, 50)
-
-    if not np.isscalar(delta):
-        sys.exit('Input argument delta must be a scalar')
-
-    if delta <= 0:
-        sys.exit('Input argument delta must be positive')
-
-    mn, mx = np.Inf, -np.Inf
-    mnpos, mxpos = np.NaN, np.NaN
-
-    lookformax = True
-    n = len(v)
-    for i in range(len(v)):
-        this = v[i]
-        if this > mx:
-            mx = this
-            mxpos = i
-
-        if this < mn:
-            mn = this
-            mnpos = i
-
-        if lookformax:
-            if this < mx - delta:
-                maxtab.append(mx)
-                maxidx.append(mxpos)
-                mn = this
-                mnpos = i
-                lookformax = False
-
-        else:
-            if this > mn + delta:
-                mintab.append(mn)
-                minidx.append(mnpos)
-                mx = this
-                mxpos = i
-                lookformax = True
-
-    return np.asarray(maxtab), np.asarray(maxidx, dtype=int), np.asarray(mintab), np.asarray(minidx, dtype=int)
+# storage of the trial traces per part table of Runs: 'blob' keeps the samples in the longblob of the table,
+# 'file' only stores their location in the recording (or a file written by migrate_traces) in Runs.TraceFiles
+TRACE_STORAGE = {
+    'VoltageTraces': 'blob',
+    'GlobalEField': 'blob',
+    'LocalEOD': 'blob',
+    'GlobalEOD': 'blob',
+}
 
 
 def scan_info(cell_id):
@@ -92,47 +50,16 @@ def scan_info(cell_id):
     :param cell_id: id of the cell
     :return: meta information about the recording as a dictionary.
     """
-    info = open(BASEDIR + cell_id + '/info.dat').readlines()
-    info = [re.sub(r'[^\x00-\x7F]+', ' ', e[1:]) for e in info]
-    meta = yaml.load(''.join(info))
-    return meta
-
-
-def get_number_and_unit(value_string):
-    """
-    Get the number and the unit from a string.
-
-    :param value_string: string with number and unit
-    :return: value, unit
-    """
-    if value_string.endswith('%'):
-        return (float(value_string.strip()[:-1]), '%')
-    try:
-        a = ureg.parse_expression(value_string)
-    except:
-        return (value_string, None)
-
-    if type(a) == list:
-        return (value_string, None)
-
-    if isinstance(a, (int, float)):
-        return (a, None)
-    else:
-        # a.ito_base_units()
-        value = a.magnitude
-        unit = "{:~}".format(a)
-        unit = unit[unit.index(" "):].replace(" ", "")
-
-        if unit == 'min':
-            unit = 's'
-            value *= 60
-        return (value, unit)
+    return read_info(BASEDIR + cell_id + '/info.dat')
 
 
 def load_traces(relacsdir, stimuli):
     """
     Loads trace files from relacs data directories,
 
+    The samples are not read into memory. 'data' is a read-only numpy.memmap of the trace file, so slicing
+    a trial only reads that trial from disk, and peakdet can process whole files in fixed-size chunks.
+
     :param relacsdir: directory where the traces are stored
     :param stimuli: stimuli file object from pyrelacs
     :return: dictionary with loaded traces
@@ -144,10 +71,15 @@ def load_traces(relacsdir, stimuli):
         tmp = {}
         sample_interval, time_unit = get_number_and_unit(meta[0]['analog input traces']['sample interval%i' % (index,)])
         sample_unit = meta[0]['analog input traces']['unit%i' % (index,)]
-        x = np.fromfile('%s/trace-%i.raw' % (relacsdir, index), np.float32)
+        filename = '%s/trace-%i.raw' % (relacsdir, index)
+        if os.path.getsize(filename) > 0:
+            x = np.memmap(filename, dtype=np.float32, mode='r')
+        else:  # empty files cannot be mapped
+            x = np.zeros(0, dtype=np.float32)
 
         tmp['unit'] = sample_unit
         tmp['trace_data'] = name
+        tmp['filename'] = filename
         tmp['data'] = x
         tmp['sample_interval'] = sample_interval
         tmp['sample_unit'] = sample_unit
@@ -155,6 +87,137 @@ def load_traces(relacsdir, stimuli):
     return {e['trace_data']: e for e in ret}
 
 
+def row_bytes(row):
+    """
+    Rough size of a row in an insert query. Arrays count with their number of bytes, all other
+    values with the length of their string representation.
+
+    :param row: dictionary with attribute values
+    :return: size in bytes
+    """
+    return sum(v.nbytes if isinstance(v, np.ndarray) else len(str(v)) for v in row.values())
+
+
+def insert_batched(table, rows, max_bytes=None, **kwargs):
+    """
+    Inserts rows into table with as few queries as possible. Rows are grouped into batches
+    whose size does not exceed max_bytes; a single row larger than that is inserted on its own.
+
+    :param table: datajoint relation to insert into
+    :param rows: iterable of dictionaries
+    :param max_bytes: maximal size of a batch in bytes, MAX_INSERT_BYTES if None
+    :param kwargs: passed on to table.insert, e.g. replace=True
+    """
+    max_bytes = MAX_INSERT_BYTES if max_bytes is None else max_bytes
+    batch, size = [], 0
+    for row in rows:
+        n = row_bytes(row)
+        if batch and size + n > max_bytes:
+            table.insert(batch, **kwargs)
+            batch, size = [], 0
+        batch.append(row)
+        size += n
+    if batch:
+        table.insert(batch, **kwargs)
+
+
+def open_trace(filename, offset, length, dtype):
+    """
+    Opens the samples of a trial that are stored outside the database.
+
+    :param filename: relacs raw file or .npy file
+    :param offset: index of the first sample of the trial in the file
+    :param length: number of samples
+    :param dtype: data type of the samples in a raw file
+    :return: read-only numpy.memmap of the trial
+    """
+    if filename.endswith('.npy'):
+        x = np.load(filename, mmap_mode='r')
+    else:
+        x = np.memmap(filename, dtype=dtype, mode='r')
+    return x[offset:offset + length]
+
+
+class TraceStore:
+    """
+    Mixin for the trace part tables of Runs. Depending on TRACE_STORAGE, the samples of a trial are either kept in
+    the longblob of the table, or outside the database. In the latter case, the longblob holds an empty array and
+    Runs.TraceFiles stores where the samples are.
+    """
+    trace_attribute = None
+
+    @property
+    def storage(self):
+        return TRACE_STORAGE.get(self.__class__.__name__, 'blob')
+
+    def load_trace(self, row):
+        """
+        Returns the samples of a trial fetched from this table or from a join with it.
+
+        :param row: fetched tuple as dictionary
+        :return: samples as numpy array, a read-only numpy.memmap if they are stored in a file
+        """
+        trace = row[self.trace_attribute]
+        if len(trace) > 0:
+            return trace
+        key = {k: row[k] for k in self.primary_key}
+        files = Runs.TraceFiles() & dict(key, trace=self.trace_attribute)
+        if not files:
+            return trace
+        return open_trace(*files.fetch1['filename', 'offset', 'length', 'dtype'])
+
+
+
+def migrate_traces(part, restriction=None, tracedir=None):
+    """
+    Moves the samples of a trace part table of Runs out of the database. Each trial is written to a .npy file,
+    registered in Runs.TraceFiles, and its longblob is replaced by an empty array. Trials that are already stored
+    in files are skipped.
+
+    :param part: one of Runs.VoltageTraces(), Runs.GlobalEField(), Runs.LocalEOD(), Runs.GlobalEOD()
+    :param restriction: optional restriction on the trials to migrate
+    :param tracedir: directory of the .npy files, TRACEDIR if None
+    """
+    tracedir = TRACEDIR if tracedir is None else tracedir
+    attr = part.trace_attribute
+    rel = part - (Runs.TraceFiles() & dict(trace=attr))
+    if restriction is not None:
+        rel = rel & restriction
+
+    for key in rel.fetch.keys():
+        trace = (part & key).fetch1[attr]
+        if len(trace) == 0:
+            continue
+        celldir = os.path.join(tracedir, key['cell_id'])
+        mkdir(celldir)
+        filename = os.path.join(celldir, '{repro}_{run_id}_{trial_id}_{attr}.npy'.format(attr=attr, **key))
+        np.save(filename, trace)
+        with part.connection.transaction:
+            Runs.TraceFiles().insert1(dict(key, trace=attr, filename=filename, offset=0, length=len(trace),
+                                           dtype=str(trace.dtype)))
+            (part & key)._update(attr, np.zeros(0, dtype=trace.dtype))
+        print('Moved', attr, 'of', key, 'to', filename)
+
+
+def add_columns(table, columns):
+    """
+    Adds attributes to a table that was declared before they were part of its definition. Existing rows get the
+    default value of the column. Attributes the table already has are skipped, so a migration can be run twice.
+
+    :param table: table instance
+    :param columns: list of (name, MySQL column definition) pairs, e.g. ('tolerance', 'double NOT NULL DEFAULT 1e-8')
+    """
+    heading = table.heading
+    missing = [(name, sql) for name, sql in columns if name not in heading.names]
+    if not missing:
+        return
+    table.connection.query('ALTER TABLE {table} {columns}'.format(
+        table=table.full_table_name,
+        columns=', '.join('ADD COLUMN `{}` {}'.format(name, sql) for name, sql in missing)))
+    heading.init_from_database(table.connection, table.database, table.table_name)
+    print('Added', ', '.join(name for name, _ in missing), 'to', table.full_table_name)
+
+
 @schema
 class PaperCells(dj.Lookup):
     definition = """
@@ -209,7 +272,86 @@ class PaperCells(dj.Lookup):
 
 
 @schema
-class EFishes(dj.Imported):
+class SourceFiles(dj.Manual):
+    definition = """
+    # size, modification time, and content hash of the relacs files a cell is imported from
+
+    ->PaperCells
+    filename                         : varchar(128)     # name of the file in the cell directory
+    ---
+    size                             : bigint           # file size in bytes
+    mtime                            : double           # modification time in s since the epoch
+    md5                              : char(32)         # md5 hash of the content
+    """
+
+    # files in BASEDIR/<cell_id>/ that EFishes, Cells, Baseline, Runs, BaseEOD, and BaseRate are imported from
+    patterns = ['info.dat', 'stimuli.dat', 'samallspikes1.dat', 'basespikes1.dat', 'baseeodtrace.dat',
+                'baserate1.dat', 'trace-*.raw']
+
+    @staticmethod
+    def md5(filename, blocksize=2 ** 20):
+        h = hashlib.md5()
+        with open(filename, 'rb') as fid:
+            for block in iter(lambda: fid.read(blocksize), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def scan(self, cell_id):
+        """
+        Compares the source files of a cell with the index. Files are only hashed again if their size or
+        modification time changed.
+
+        :param cell_id: id of the cell
+        :return: current index rows of the cell, whether the content of any file changed
+        """
+        basedir = BASEDIR + cell_id
+        old = {row['filename']: row for row in (self & dict(cell_id=cell_id)).fetch.as_dict()}
+        rows = []
+        for pattern in self.patterns:
+            for filename in sorted(glob(os.path.join(basedir, pattern))):
+                stat = os.stat(filename)
+                row = dict(cell_id=cell_id, filename=os.path.basename(filename), size=stat.st_size,
+                           mtime=stat.st_mtime)
+                prev = old.get(row['filename'])
+                if prev is not None and prev['size'] == row['size'] and prev['mtime'] == row['mtime']:
+                    row['md5'] = prev['md5']
+                else:
+                    row['md5'] = self.md5(filename)
+                rows.append(row)
+        changed = {r['filename']: r['md5'] for r in rows} != {k: r['md5'] for k, r in old.items()}
+        return rows, changed
+
+    def reset_changed(self):
+        """
+        Deletes the imported data of all cells whose source files changed since the last call, together with
+        everything that depends on it, and updates the index. The cells are re-imported by the next populate.
+        Cells that are not in the index yet are only indexed. If a delete is declined at the safemode prompt, the
+        index of that cell is not updated, so the change is reported again by the next call.
+
+        :return: ids of the cells that have to be re-imported
+        """
+        changed_cells = []
+        for key in (PaperCells() & dict(locking_experiment=1)).fetch.keys():
+            if not os.path.isdir(BASEDIR + key['cell_id']):
+                continue
+            indexed = len(self & key) > 0
+            rows, changed = self.scan(key['cell_id'])
+            if indexed and changed:
+                print('Sources of', key['cell_id'], 'changed. Deleting imported data.')
+                (EFishes() & key).delete()
+                if len(EFishes() & key) > 0:  # the delete was declined, keep the old index to detect it again
+                    print('Data of', key['cell_id'], 'was not deleted. Keeping its old index.')
+                    continue
+                changed_cells.append(key['cell_id'])
+            with self.connection.transaction:
+                (self & key).delete_quick()
+                if rows:
+                    self.insert(rows)
+        return changed_cells
+
+
+@schema
+class EFishes(Profiled, dj.Imported):
     definition = """
     # Basics weakly electric fish subject info
 
@@ -252,7 +394,7 @@ class EFishes(dj.Imported):
 
 
 @schema
-class Cells(dj.Imported):
+class Cells(Profiled, dj.Imported):
     definition = """
     # Recorded cell with additional info
 
@@ -286,7 +428,7 @@ class Cells(dj.Imported):
 
 
 @schema
-class FICurves(dj.Imported):
+class FICurves(Profiled, dj.Imported):
     definition = """
     # FI  Curves from recorded cells
 
@@ -338,7 +480,7 @@ class FICurves(dj.Imported):
 
 
 @schema
-class ISIHistograms(dj.Imported):
+class ISIHistograms(Profiled, dj.Imported):
     definition = """
     # ISI Histograms
 
@@ -379,7 +521,7 @@ class ISIHistograms(dj.Imported):
 
 
 @schema
-class Baseline(dj.Imported):
+class Baseline(Profiled, dj.Imported):
     definition = """
     # table holding baseline recordings
     ->Cells
@@ -568,7 +710,7 @@ class Baseline(dj.Imported):
                     sis.append(si)
                 assert len(np.unique(sis)) == 1, 'Different sampling intervals!'
 
-                duration = ureg.parse_expression(spi_m['duration']).to(time_unit).magnitude
+                duration = convert_to(spi_m['duration'], time_unit)
 
                 start_idx, stop_idx = [], []
                 # start_times, stop_times = [], []
@@ -586,20 +728,24 @@ class Baseline(dj.Imported):
 
                 self.insert1(to_insert)
 
+                localeod_rows, spike_rows = [], []
                 for trial_idx, (start, stop) in enumerate(zip(start_idx, stop_idx)):
                     if start > 0:
                         tmp = dict(key, repeat=spi_m['index'])
                         leod = traces['LocalEOD-1']['data'][start:stop]
                         _, tmp['peaks'], _, tmp['troughs'] = peakdet(leod)
-                        localeod.insert1(tmp, replace=True)
+                        localeod_rows.append(tmp)
                     else:
                         print("Negative indices in stimuli.dat. Skipping local peak extraction!")
 
-                    spike_table.insert1(dict(key, times=spi_d, repeat=spi_m['index']), replace=True)
+                    spike_rows.append(dict(key, times=spi_d, repeat=spi_m['index']))
+
+                insert_batched(localeod, localeod_rows, replace=True)
+                insert_batched(spike_table, spike_rows, replace=True)
 
 
 @schema
-class Runs(dj.Imported):
+class Runs(Profiled, dj.Imported):
     definition = """
     # table holding trials
 
@@ -630,7 +776,7 @@ class Runs(dj.Imported):
         times                      : longblob # spikes times in ms
         """
 
-    class GlobalEField(dj.Part, dj.Manual):
+    class GlobalEField(dj.Part, dj.Manual, TraceStore):
         definition = """
         # table holding global efield trace
 
@@ -640,8 +786,9 @@ class Runs(dj.Imported):
 
         global_efield                      : longblob # spikes times
         """
+        trace_attribute = 'global_efield'
 
-    class LocalEOD(dj.Part, dj.Manual):
+    class LocalEOD(dj.Part, dj.Manual, TraceStore):
         definition = """
         # table holding local EOD traces
 
@@ -651,8 +798,9 @@ class Runs(dj.Imported):
 
         local_efield                      : longblob # spikes times
         """
+        trace_attribute = 'local_efield'
 
-    class GlobalEOD(dj.Part, dj.Manual):
+    class GlobalEOD(dj.Part, dj.Manual, TraceStore):
         definition = """
         # table holding global EOD traces
 
@@ -662,8 +810,9 @@ class Runs(dj.Imported):
 
         global_voltage                      : longblob # spikes times
         """
+        trace_attribute = 'global_voltage'
 
-    class VoltageTraces(dj.Part, dj.Manual):
+    class VoltageTraces(dj.Part, dj.Manual, TraceStore):
         definition = """
         # table holding voltage traces
 
@@ -673,16 +822,38 @@ class Runs(dj.Imported):
 
         membrane_potential                      : longblob # spikes times
         """
+        trace_attribute = 'membrane_potential'
+
+    class TraceFiles(dj.Part):
+        definition = """
+        # location of trial traces that are stored outside the database
+
+        -> Runs
+        trial_id                   : int # index of the trial within run
+        trace                      : enum('membrane_potential', 'global_efield', 'local_efield', 'global_voltage')
+        ---
+
+        filename                   : varchar(512) # relacs raw file or .npy file
+        offset                     : bigint # index of the first sample of the trial in the file
+        length                     : int # number of samples
+        dtype                      : varchar(16) # data type of the samples
+        """
+
+    # If True, _make_tuples also extracts peaks and troughs of the global efield, the local EOD, and the
+    # global EOD from the trial slices it already holds and inserts them into GlobalEFieldPeaksTroughs,
+    # LocalEODPeaksTroughs, and GlobalEODPeaksTroughs. This saves fetching every trace back from the
+    # database when these tables are populated.
+    extract_peaks = False
 
     def load_spikes(self):
         """
         Loads all spikes referring to that relation.
 
-        :return: trial ids and spike times in s
+        :return: trial ids and spike times in s as SpikeTrains
         """
-        spike_times, trial_ids = (Runs.SpikeTimes() & self).fetch['times', 'trial_id']
-        spike_times = [s / 1000 for s in spike_times]  # convert to s
-        return trial_ids, spike_times
+        trials = fetch_cached(Runs.SpikeTimes() & self, 'times')
+        trial_ids = np.array([trial['trial_id'] for trial in trials])
+        return trial_ids, SpikeTrains.from_list([trial['times'] for trial in trials]).to_seconds()
 
     def _make_tuples(self, key):
         repro = 'SAM'
@@ -745,7 +916,7 @@ class Runs(dj.Imported):
                     sis.append(si)
                 assert len(np.unique(sis)) == 1, 'Different sampling intervals!'
 
-                duration = ureg.parse_expression(spi_m['Settings']['Stimulus']['duration']).to(time_unit).magnitude
+                duration = convert_to(spi_m['Settings']['Stimulus']['duration'], time_unit)
 
                 if 'ampl' in spi_m['Settings']['Stimulus']:
                     nharmonics = len(list(map(float, spi_m['Settings']['Stimulus']['ampl'].strip().split(','))))
@@ -774,30 +945,42 @@ class Runs(dj.Imported):
                 to_insert['repro'] = 'SAM'
 
                 self.insert1(to_insert)
+                peak_tables = [(GlobalEFieldPeaksTroughs(), 'GlobalEFie'), (LocalEODPeaksTroughs(), 'LocalEOD-1'),
+                               (GlobalEODPeaksTroughs(), 'EOD')]
+                peak_rows = [[] for _ in peak_tables]
+                # rows of a run are collected and inserted in batches, which saves a round-trip per trial and trace
+                trace_tables = [(v1trace, 'V-1', 'membrane_potential'), (globalefield, 'GlobalEFie', 'global_efield'),
+                                (localeod, 'LocalEOD-1', 'local_efield'), (globaleod, 'EOD', 'global_voltage')]
+                trace_rows = [[] for _ in trace_tables]
+                spike_rows, file_rows = [], []
                 for trial_idx, (start, stop) in enumerate(zip(start_idx, stop_idx)):
                     tmp = dict(run_id=run_idx, trial_id=trial_idx, repro='SAM', **key)
-                    tmp['membrane_potential'] = traces['V-1']['data'][start:stop]
-                    v1trace.insert1(tmp, replace=True)
-                    del tmp['membrane_potential']
-
-                    tmp['global_efield'] = traces['GlobalEFie']['data'][start:stop]
-                    globalefield.insert1(tmp, replace=True)
-                    del tmp['global_efield']
-
-                    tmp['local_efield'] = traces['LocalEOD-1']['data'][start:stop]
-                    localeod.insert1(tmp, replace=True)
-                    del tmp['local_efield']
-
-                    tmp['global_voltage'] = traces['EOD']['data'][start:stop]
-                    globaleod.insert1(tmp, replace=True)
-                    del tmp['global_voltage']
-
-                    tmp['times'] = spi_d[trial_idx]
-                    spike_table.insert1(tmp, replace=True)
+                    if self.extract_peaks:
+                        for (_, trace), rows in zip(peak_tables, peak_rows):
+                            row = dict(tmp)
+                            _, row['peaks'], _, row['troughs'] = peakdet(traces[trace]['data'][start:stop])
+                            rows.append(row)
+
+                    for (table, trace, attr), rows in zip(trace_tables, trace_rows):
+                        x = traces[trace]['data'][start:stop]
+                        if table.storage == 'file':
+                            file_rows.append(dict(tmp, trace=attr, filename=traces[trace]['filename'],
+                                                  offset=int(start), length=len(x), dtype=str(x.dtype)))
+                            x = np.zeros(0, dtype=x.dtype)
+                        rows.append(dict(tmp, **{attr: x}))
+
+                    spike_rows.append(dict(tmp, times=spi_d[trial_idx]))
+
+                for (table, _, _), rows in zip(trace_tables, trace_rows):
+                    insert_batched(table, rows, replace=True)
+                insert_batched(Runs.TraceFiles(), file_rows, replace=True)
+                insert_batched(spike_table, spike_rows, replace=True)
+                for (table, _), rows in zip(peak_tables, peak_rows):
+                    insert_batched(table, rows, replace=True)
 
 
 @schema
-class BaseEOD(dj.Imported):
+class BaseEOD(Profiled, dj.Imported):
     definition = """
         # table holding baseline rate with EOD
         ->Cells
@@ -816,7 +999,7 @@ class BaseEOD(dj.Imported):
         basedir = BASEDIR + key['cell_id']
         filename = basedir + '/baseeodtrace.dat'
         if os.path.isfile(filename):
-            rate = TraceFile(filename)
+            rate = load_tracefile(filename)
         else:
             print('No such file', filename, 'skipping. ')
             return
@@ -833,7 +1016,7 @@ class BaseEOD(dj.Imported):
 
 
 @schema
-class BaseRate(dj.Imported):
+class BaseRate(Profiled, dj.Imported):
     definition = """
         # table holding baseline rate with EOD
         ->Cells
@@ -853,7 +1036,7 @@ class BaseRate(dj.Imported):
         basedir = BASEDIR + key['cell_id']
         filename = basedir + '/baserate1.dat'
         if os.path.isfile(filename):
-            rate = TraceFile(filename)
+            rate = load_tracefile(filename)
         else:
             print('No such file', filename, 'skipping. ')
             return
@@ -891,7 +1074,7 @@ class BaseRate(dj.Imported):
 
 
 @schema
-class GlobalEFieldPeaksTroughs(dj.Computed):
+class GlobalEFieldPeaksTroughs(Profiled, dj.Computed):
     definition = """
     # table for peaks and troughs in the global efield
 
@@ -906,12 +1089,12 @@ class GlobalEFieldPeaksTroughs(dj.Computed):
     def _make_tuples(self, key):
         dat = (Runs.GlobalEField() & key).fetch1()
 
-        _, key['peaks'], _, key['troughs'] = peakdet(dat['global_efield'])
+        _, key['peaks'], _, key['troughs'] = peakdet(Runs.GlobalEField().load_trace(dat))
         self.insert1(key)
 
 
 @schema
-class LocalEODPeaksTroughs(dj.Computed):
+class LocalEODPeaksTroughs(Profiled, dj.Computed):
     definition = """
     # table for peaks and troughs in local EOD
 
@@ -926,12 +1109,12 @@ class LocalEODPeaksTroughs(dj.Computed):
     def _make_tuples(self, key):
         dat = (Runs.LocalEOD() & key).fetch1()
 
-        _, key['peaks'], _, key['troughs'] = peakdet(dat['local_efield'])
+        _, key['peaks'], _, key['troughs'] = peakdet(Runs.LocalEOD().load_trace(dat))
         self.insert1(key)
 
 
 @schema
-class GlobalEODPeaksTroughs(dj.Computed):
+class GlobalEODPeaksTroughs(Profiled, dj.Computed):
     definition = """
     # table for peaks and troughs in global EOD
 
@@ -946,12 +1129,12 @@ class GlobalEODPeaksTroughs(dj.Computed):
     def _make_tuples(self, key):
         dat = (Runs.GlobalEOD() & key).fetch1()
 
-        _, key['peaks'], _, key['troughs'] = peakdet(dat['global_voltage'])
+        _, key['peaks'], _, key['troughs'] = peakdet(Runs.GlobalEOD().load_trace(dat))
         self.insert1(key)
 
 
 @schema
-class PUnitPhases(dj.Imported):
+class PUnitPhases(Profiled, dj.Imported):
     definition = """
     # data from baseline activity of P-Units for phase computations
 
@@ -0,0 +1,257 @@
+"""
+Simulation engine for the P-unit model: a damped harmonic oscillator driven by the EOD, a rectifying low-pass
+stage, and a leaky integrate-and-fire neuron.
+
+The oscillator and the low-pass are linear, so they are discretized exactly for inputs that are linear between
+samples (first order hold) and run with scipy.signal.lfilter instead of integrating the ODE with odeint. The LIF
+is simulated for all trials at once in blocks of time steps: within a block, the membrane potential of every
+trial is computed with lfilter, and each threshold crossing is handled by adding the decaying effect of the reset
+to the rest of the block.
+
+Example::
+
+    v_in = punit_drive(stimulus(t), dt, zeta, w0, gain, alpha, tau) - offset
+    spikes = lif(v_in, t, n=50, tau=lif_tau, threshold=threshold, reset=reset, noise_sd=noise_sd)
+"""
+from functools import lru_cache
+
+import numpy as np
+from scipy.linalg import expm
+from scipy.signal import cont2discrete, lfilter, ss2tf
+
+from .spectra import mean_vector_strength
+from .spiketrains import SpikeTrains
+
+LIF_BLOCK_SIZE = 256  # time steps of the LIF that are simulated at once
+
+
+@lru_cache(maxsize=64)
+def _foh_filter(A, B, dt):
+    """
+    Transfer function of dx/dt = A x + B u, y = x[0], discretized with a first order hold.
+
+    :param A: system matrix as tuple of tuples
+    :param B: input matrix as tuple of tuples
+    :param dt: time step
+    :return: numerator, denominator for lfilter
+    """
+    A, B = np.array(A), np.array(B)
+    C = np.eye(1, len(A))
+    Ad, Bd, Cd, Dd, _ = cont2discrete((A, B, C, np.zeros((1, 1))), dt, method='foh')
+    b, a = ss2tf(Ad, Bd, Cd, Dd)
+    return b[0], a
+
+
+def _linear_response(A, B, u, dt, x0=None):
+    """
+    Output y = x[0] of the linear system dx/dt = A x + B u for samples u of the input and the initial state x0.
+
+    The filter starts from rest and sees the input rise linearly from zero before the first sample, so it is only
+    run on u - u[0]. The response to the constant u[0] from the initial state is added in closed form with the
+    eigendecomposition of expm(A dt); A has to be invertible.
+    """
+    A, B = np.asarray(A, dtype=np.float64), np.asarray(B, dtype=np.float64)
+    u = np.asarray(u, dtype=np.float64)
+    b, a = _foh_filter(tuple(map(tuple, A)), tuple(map(tuple, B)), dt)
+    y = lfilter(b, a, u - u[0])
+
+    # x(k dt) = x_ss + expm(A dt)^k (x0 - x_ss) with the steady state x_ss of the constant input u[0]
+    x_ss = -np.linalg.solve(A, B[:, 0] * u[0])
+    x0 = np.zeros(len(A)) if x0 is None else np.asarray(x0, dtype=np.float64)
+    if np.any(x0 != x_ss):
+        lam, V = np.linalg.eig(expm(A * dt))
+        c = np.linalg.solve(V, (x0 - x_ss).astype(np.complex128))
+        k = np.arange(len(u))
+        y += np.real(np.exp(np.outer(k, np.log(lam.astype(np.complex128)))) @ (V[0] * c))
+    return y + x_ss[0]
+
+
+def resonator_constants(resonant_freq, zeta):
+    """
+    Undamped angular frequency of the resonator with its amplitude peak at resonant_freq, and the normalization
+    alpha that makes the peak amplitude one.
+
+    :param resonant_freq: resonant frequency in Hz
+    :param zeta: damping ratio
+    :return: w0, alpha
+    """
+    wr = 2 * np.pi * resonant_freq
+    w0 = wr / np.sqrt(1 - 2 * zeta ** 2)
+    Zm = np.sqrt((2 * w0 * zeta) ** 2 + (wr ** 2 - w0 ** 2) ** 2 / wr ** 2)
+    return w0, wr * Zm
+
+
+def resonator(u, dt, zeta, w0, y0=None):
+    """
+    Position of the damped harmonic oscillator d^2y/dt^2 + 2 zeta w0 dy/dt + w0^2 y = u(t).
+
+    :param u: input sampled with dt
+    :param dt: time step in s
+    :param zeta: damping ratio
+    :param w0: undamped angular frequency in rad/s
+    :param y0: initial position and velocity; zero if None
+    :return: position at the sample times
+    """
+    A = [[0., 1.], [-w0 ** 2, -2 * zeta * w0]]
+    return _linear_response(A, [[0.], [1.]], u, dt, x0=y0)
+
+
+def lowpass(u, dt, tau, z0=0.):
+    """
+    First order low-pass dz/dt = (u(t) - z) / tau.
+
+    :param u: input sampled with dt
+    :param dt: time step in s
+    :param tau: time constant in s
+    :param z0: initial value
+    :return: output at the sample times
+    """
+    return _linear_response([[-1. / tau]], [[1. / tau]], u, dt, x0=[z0])
+
+
+def punit_drive(u, dt, zeta, w0, gain, alpha, tau, y0=None):
+    """
+    Input current of the P-unit LIF: the resonator driven by u, rectified, scaled by gain * alpha, and low-pass
+    filtered with tau. Equivalent to integrating the three dimensional ODE of LIFPUnit.simulate with odeint.
+
+    :param u: stimulus sampled with dt
+    :param dt: time step in s
+    :param zeta: damping ratio of the resonator
+    :param w0: undamped angular frequency of the resonator in rad/s
+    :param gain: gain of the rectified resonator
+    :param alpha: amplitude normalization of the resonator
+    :param tau: time constant of the low-pass in s
+    :param y0: initial position, velocity, and low-pass state; zero if None
+    :return: low-pass output at the sample times
+    """
+    y0 = np.zeros(3) if y0 is None else np.asarray(y0, dtype=np.float64)
+    y = resonator(u, dt, zeta, w0, y0=y0[:2])
+    return lowpass(gain * alpha * np.maximum(y, 0), dt, tau, z0=y0[2])
+
+
+def lif(drive, t, n, tau, threshold, reset, noise_sd, v0=0., block_size=None, rng=None, record_every=None):
+    """
+    Leaky integrate-and-fire neurons with white noise, simulated for n trials at once. Each time step computes
+    V += (drive - V) * dt / tau + noise_sd * sqrt(dt) * N(0, 1) and resets V to reset after it exceeded
+    threshold. The noise is drawn from rng in the same order as one rng.standard_normal(n) per time step.
+
+    Several neurons can be simulated as one batch by passing one drive per row and arrays of thresholds, resets,
+    and noise standard deviations with one entry per row. The trials are then ordered by row, i.e. trial i of row
+    p has index p * n + i.
+
+    :param drive: input at the times t, or array with one input per row
+    :param t: equidistant time points
+    :param n: number of trials per row of drive
+    :param tau: membrane time constant in s, shared by all rows
+    :param threshold: spike threshold, scalar or one per row
+    :param reset: reset potential, scalar or one per row
+    :param noise_sd: noise standard deviation, scalar or one per row
+    :param v0: initial membrane potential
+    :param block_size: time steps simulated at once, LIF_BLOCK_SIZE if None
+    :param rng: np.random.Generator of the noise, the global np.random state if None
+    :param record_every: if given, the membrane potential after the reset is recorded every record_every steps
+    :return: spike times as SpikeTrains; spike times and recorded membrane potential (trials x recorded steps)
+             if record_every is given
+    """
+    block_size = LIF_BLOCK_SIZE if block_size is None else block_size
+    rng = np.random if rng is None else rng
+    t = np.asarray(t)
+    dt = t[1] - t[0]
+    a = 1 - dt / tau
+    inputs = np.atleast_2d(np.asarray(drive, dtype=np.float64)) * dt / tau
+    trials = len(inputs) * n
+    threshold, reset, noise_sd = (np.repeat(np.broadcast_to(np.asarray(p, dtype=np.float64), len(inputs)), n)
+                                  for p in (threshold, reset, noise_sd))
+    decay = a ** np.arange(block_size)
+    v = np.full(trials, v0, dtype=np.float64)
+    if record_every is not None:
+        recorded = np.arange(0, len(t), record_every)
+        V = np.empty((trials, len(recorded)))
+
+    trial_idx, step_idx = [], []
+    for start in range(0, len(t), block_size):
+        stop = min(start + block_size, len(t))
+        m = stop - start
+        noise = rng.standard_normal((m, trials)).T * (np.sqrt(dt) * noise_sd[:, None])
+        x, _ = lfilter([1.], [1., -a], np.repeat(inputs[:, start:stop], n, axis=0) + noise, axis=1,
+                       zi=a * v[:, None])
+
+        # handle the threshold crossings in temporal order; a reset at step k adds (reset - x[k]) * a^(j - k)
+        # to all later steps j of that trial
+        steps = np.arange(m)
+        rows = np.arange(trials)
+        after = np.full(trials, -1)
+        while len(rows) > 0:
+            above = (x[rows] > threshold[rows, None]) & (steps > after[rows, None])
+            crossed = above.any(axis=1)
+            rows, k = rows[crossed], above[crossed].argmax(axis=1)
+            if len(rows) == 0:
+                break
+            trial_idx.append(rows)
+            step_idx.append(start + k)
+            lag = steps - k[:, None]
+            x[rows] += np.where(lag >= 0, (reset[rows] - x[rows, k])[:, None] * decay[np.maximum(lag, 0)], 0)
+            x[rows, k] = reset[rows]
+            after[rows] = k
+        v = x[:, -1]
+        if record_every is not None:
+            idx = recorded[(recorded >= start) & (recorded < stop)]
+            V[:, idx // record_every] = x[:, idx - start]
+
+    trial_idx = np.concatenate(trial_idx) if trial_idx else np.zeros(0, dtype=int)
+    step_idx = np.concatenate(step_idx) if step_idx else np.zeros(0, dtype=int)
+    order = np.lexsort((step_idx, trial_idx))
+    offsets = np.zeros(trials + 1, dtype=np.int64)
+    np.cumsum(np.bincount(trial_idx, minlength=trials), out=offsets[1:])
+    spikes = SpikeTrains(t[step_idx[order]], offsets)
+    return spikes if record_every is None else (spikes, V)
+
+
+def summarize_parameter_sets(stimulus, dt, eod, frequencies, parameter_sets, n, isi_bins, seed):
+    """
+    Simulates n trials of the P-unit model for each parameter set and summarizes the spike trains. Parameter
+    sets with the same lif_tau are simulated as one (parameter sets x trials x time) batch by lif. The drive only
+    depends on zeta and tau up to the factor gain, so it is computed once per pair.
+
+    Only uses numpy and scipy, so it can run in worker processes without a database connection.
+
+    :param stimulus: stimulus sampled with dt, starting at time zero
+    :param dt: time step in s
+    :param eod: EOD frequency in Hz, resonant frequency of the oscillator and unit of isi_bins
+    :param frequencies: frequencies at which the vector strength is computed
+    :param parameter_sets: list of dictionaries with zeta, tau, gain, offset, noise_sd, threshold, reset, lif_tau
+    :param n: number of trials per parameter set
+    :param isi_bins: edges of the ISI histogram in EOD cycles
+    :param seed: seed or np.random.SeedSequence of the noise
+    :return: firing rates in Hz, ISI histograms normalized to the number of intervals (one row per parameter
+             set), mean vector strength over the trials with spikes at the frequencies (one row per parameter set,
+             nan if no trial has spikes)
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(len(stimulus)) * dt
+    rates = np.empty(len(parameter_sets))
+    histograms = np.empty((len(parameter_sets), len(isi_bins) - 1))
+    vector_strengths = np.empty((len(parameter_sets), len(frequencies)))
+
+    drives = {}
+    for lif_tau in sorted({p['lif_tau'] for p in parameter_sets}):
+        idx = [i for i, p in enumerate(parameter_sets) if p['lif_tau'] == lif_tau]
+        batch = [parameter_sets[i] for i in idx]
+        for p in batch:
+            if (p['zeta'], p['tau']) not in drives:
+                w0, alpha = resonator_constants(eod, p['zeta'])
+                drives[p['zeta'], p['tau']] = punit_drive(stimulus, dt, p['zeta'], w0, 1., alpha, p['tau'])
+        drive = np.vstack([p['gain'] * drives[p['zeta'], p['tau']] - p['offset'] for p in batch])
+        spikes = lif(drive, t, n, lif_tau, *([p[k] for p in batch] for k in ('threshold', 'reset', 'noise_sd')),
+                     rng=rng)
+
+        for j, i in enumerate(idx):
+            start, stop = spikes.offsets[j * n], spikes.offsets[(j + 1) * n]
+            trials = SpikeTrains(spikes.data[start:stop], spikes.offsets[j * n:(j + 1) * n + 1] - start)
+            rates[i] = len(trials.data) / n / (len(t) * dt)
+            isi = trials.intervals().data * eod
+            histograms[i] = np.histogram(isi, bins=isi_bins)[0] / max(len(isi), 1)
+            counts = trials.counts[trials.counts > 0]  # empty trials have no vector strength
+            nonempty = SpikeTrains(trials.data, np.concatenate(([0], np.cumsum(counts))))
+            vector_strengths[i] = mean_vector_strength(nonempty, frequencies)
+    return rates, histograms, vector_strengths
@@ -0,0 +1,92 @@
+import numpy as np
+
+SQRT_EPS = np.sqrt(2.2e-16)
+GOLDEN_MEAN = 0.5 * (3.0 - np.sqrt(5.0))
+
+
+def fminbound_batched(func, lower, upper, xtol=1e-5, maxfun=500):
+    """
+    Bounded scalar minimization of many independent problems at once.
+
+    Runs the same steps as scipy.optimize.fminbound (Brent's method with golden-section and parabolic steps)
+    for every interval [lower[i], upper[i]], but evaluates func for all unconverged problems in one call.
+    The results are the ones of separate fminbound calls up to floating point differences in func.
+
+    :param func: vectorized objective; called with an array of points, one per unconverged problem, returns an
+                 array of function values
+    :param lower: lower bounds
+    :param upper: upper bounds
+    :param xtol: absolute tolerance of the solutions
+    :param maxfun: maximal number of function evaluations per problem
+    :return: minimizers, function values at the minimizers
+    """
+    a = np.array(lower, dtype=np.float64, ndmin=1)
+    b = np.array(upper, dtype=np.float64, ndmin=1)
+    fulc = a + GOLDEN_MEAN * (b - a)
+    nfc, xf = fulc.copy(), fulc.copy()
+    rat = np.zeros(len(a))
+    e = np.zeros(len(a))
+    fx = np.asarray(func(xf), dtype=np.float64)
+    ffulc, fnfc = fx.copy(), fx.copy()
+    xm = 0.5 * (a + b)
+    tol1 = SQRT_EPS * np.abs(xf) + xtol / 3.0
+    tol2 = 2.0 * tol1
+
+    active = np.abs(xf - xm) > (tol2 - 0.5 * (b - a))
+    num = 1
+    while np.any(active) and num < maxfun:
+        i = np.flatnonzero(active)
+        ai, bi, xfi, xmi, ei, rati = a[i], b[i], xf[i], xm[i], e[i], rat[i]
+        t1, t2 = tol1[i], tol2[i]
+
+        # parabolic fit through the three best points
+        golden = np.abs(ei) <= t1
+        parabolic = ~golden
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = (xfi - nfc[i]) * (fx[i] - ffulc[i])
+            q = (xfi - fulc[i]) * (fx[i] - fnfc[i])
+            p = (xfi - fulc[i]) * q - (xfi - nfc[i]) * r
+            q = 2.0 * (q - r)
+            p = np.where(q > 0.0, -p, p)
+            q = np.abs(q)
+            r = ei
+            ei = np.where(parabolic, rati, ei)
+            accept = parabolic & (np.abs(p) < np.abs(0.5 * q * r)) & (p > q * (ai - xfi)) & (p < q * (bi - xfi))
+            rati = np.where(accept, p / q, rati)
+        x = xfi + rati
+        near_bound = accept & (((x - ai) < t2) | ((bi - x) < t2))
+        si = np.sign(xmi - xfi) + ((xmi - xfi) == 0)
+        rati = np.where(near_bound, t1 * si, rati)
+
+        # golden-section step where the parabola was not tried or not accepted
+        golden |= parabolic & ~accept
+        ei = np.where(golden, np.where(xfi >= xmi, ai - xfi, bi - xfi), ei)
+        rati = np.where(golden, GOLDEN_MEAN * ei, rati)
+
+        si = np.sign(rati) + (rati == 0)
+        x = xfi + si * np.maximum(np.abs(rati), t1)
+        fu = np.asarray(func(x), dtype=np.float64)
+        num += 1
+
+        # update the bracket and the three best points
+        better = fu <= fx[i]
+        ai = np.where(better & (x >= xfi), xfi, np.where(~better & (x < xfi), x, ai))
+        bi = np.where(better & (x < xfi), xfi, np.where(~better & (x >= xfi), x, bi))
+
+        fulci, ffulci, nfci, fnfci = fulc[i], ffulc[i], nfc[i], fnfc[i]
+        second = ~better & ((fu <= fnfci) | (nfci == xfi))
+        third = ~better & ~second & ((fu <= ffulci) | (fulci == xfi) | (fulci == nfci))
+        fulc[i] = np.where(better | second, nfci, np.where(third, x, fulci))
+        ffulc[i] = np.where(better | second, fnfci, np.where(third, fu, ffulci))
+        nfc[i] = np.where(better, xfi, np.where(second, x, nfci))
+        fnfc[i] = np.where(better, fx[i], np.where(second, fu, fnfci))
+        xf[i] = np.where(better, x, xfi)
+        fx[i] = np.where(better, fu, fx[i])
+
+        a[i], b[i], e[i], rat[i] = ai, bi, ei, rati
+        xm[i] = 0.5 * (ai + bi)
+        tol1[i] = SQRT_EPS * np.abs(xf[i]) + xtol / 3.0
+        tol2[i] = 2.0 * tol1[i]
+        active[i] = np.abs(xf[i] - xm[i]) > (tol2[i] - 0.5 * (bi - ai))
+
+    return xf, fx
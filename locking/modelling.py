@@ -1,3 +1,5 @@
+import itertools
+import multiprocessing
 import warnings
 
 import matplotlib.pyplot as plt
@@ -6,37 +8,39 @@ import pandas as pd
 import seaborn as sns
 from scipy import stats
 from scipy.integrate import odeint
-from scipy.signal import butter, filtfilt
+from scipy.signal import butter, filtfilt, resample_poly
 
 import datajoint as dj
 import pycircstat as circ
 import datajoint as dj
 from .analyses import TrialAlign
+from .blobcache import fetch_cached
+from .critical_values import poisson_threshold
+from .lif import lif, punit_drive, resonator_constants, summarize_parameter_sets
+from .profiling import Profiled
+from .seeds import key_seed, seed_generator, spawn_generators, spawn_seeds
 from . import mkdir
 from locking.data import peakdet, Runs, Cells, LocalEODPeaksTroughs, CenteredPUnitPhases, UncenteredPUnitPhases, \
-    GlobalEFieldPeaksTroughs, GlobalEODPeaksTroughs, EFishes, PaperCells
+    GlobalEFieldPeaksTroughs, GlobalEODPeaksTroughs, EFishes, PaperCells, add_columns
 from scipy import interp
 from . import colordict, markerdict
 schema = dj.schema('efish_modelling', locals())
 
+# parameters of the LIF P-unit model 'nwgimproved'; the resonant frequency is the EOD frequency of the fish
+NWG_IMPROVED = dict(zeta=0.2, tau=0.002, gain=70, offset=9, noise_sd=30, threshold=14., reset=0., lif_tau=0.001)
+SWEEP_PROCESSES = None  # worker processes of LIFSweepSummary, one per CPU if None
+SWEEP_BATCH_SIZE = 16  # parameter sets per task of LIFSweepSummary
+SWEEP_ISI_BINS = np.linspace(0, 15, 151)  # edges of the ISI histograms of LIFSweepSummary in EOD cycles
+RECORDING_RATE = 20000.  # sampling rate of the signals of PUnitSimulations with recording 'decimated' in Hz
+RECORDING_F_MAX = 4000.  # largest frequency of the spectra of PUnitSimulations with recording 'spectrum' in Hz
+
 
 def val_at(w, f, w0, tol=2):
     return np.max(f[np.abs(w - w0) < tol])
 
 def second_order_critical_vector_strength(spikes, alpha=0.001):
     spikes_per_trial = [len(s) for s in spikes]
-    poiss_rate = np.mean(spikes_per_trial)
-    r = np.linspace(0, 2, 10000)
-    dr = r[1] - r[0]
-    mu = np.sum(2 * poiss_rate * r ** 2 * np.exp(poiss_rate * np.exp(-r ** 2) - poiss_rate - r ** 2) / (
-        1 - np.exp(-poiss_rate))) * dr
-    s = np.sum(2 * poiss_rate * r ** 3 * np.exp(poiss_rate * np.exp(-r ** 2) - poiss_rate - r ** 2) / (
-        1 - np.exp(-poiss_rate))) * dr
-    s2 = np.sqrt(s - mu ** 2.)
-    threshold = stats.norm.ppf(1 - alpha, loc=mu,
-                               scale=s2 / np.sqrt(len(spikes_per_trial)))  # use central limit theorem
-
-    return threshold
+    return poisson_threshold(np.mean(spikes_per_trial), len(spikes_per_trial), alpha)
 
 
 def butter_lowpass_filter(data, highcut, fs, order=5):
@@ -52,6 +56,44 @@ def butter_lowpass(highcut, fs, order=5):
     return b, a
 
 
+def record_signal(x, dt, recording):
+    """
+    Representation of a simulated signal that is stored by PUnitSimulations.
+
+    :param x: signal sampled with dt
+    :param dt: time step in s
+    :param recording: 'full' (float64), 'float32', 'decimated' to RECORDING_RATE with an anti-aliasing filter, or
+                      'spectrum' (amplitude spectrum up to RECORDING_F_MAX)
+    :return: stored signal, sampling rate of the stored signal or of the signal the spectrum was computed from
+    """
+    if recording == 'full':
+        return np.asarray(x, dtype=np.float64), 1 / dt
+    if recording == 'float32':
+        return np.asarray(x, dtype=np.float32), 1 / dt
+    if recording == 'decimated':
+        q = max(1, int(round(1 / (dt * RECORDING_RATE))))
+        return resample_poly(x, 1, q), 1 / (dt * q)
+    if recording == 'spectrum':
+        return np.abs(np.fft.rfft(x))[np.fft.rfftfreq(len(x), dt) <= RECORDING_F_MAX], 1 / dt
+    raise ValueError('Unknown recording ' + recording)
+
+
+def recorded_spectrum(stored, rate, n, recording):
+    """
+    Amplitude spectrum at the non-negative frequencies of a signal stored by record_signal. Spectra of decimated
+    signals are scaled to the amplitudes of the full signal.
+
+    :param stored: stored signal
+    :param rate: sampling rate returned by record_signal
+    :param n: number of samples of the simulated signal
+    :param recording: representation of the stored signal
+    :return: frequencies, amplitudes
+    """
+    if recording == 'spectrum':
+        return np.fft.rfftfreq(n, 1 / rate)[:len(stored)], stored
+    return np.fft.rfftfreq(len(stored), 1 / rate), np.abs(np.fft.rfft(stored)) * n / len(stored)
+
+
 def normalize_signal(eod, samplerate, norm_window=.5):
     max_time = len(eod) / samplerate
 
@@ -191,7 +233,7 @@ class NoHarmonics(dj.Lookup):
 
 
 @schema
-class EODFit(dj.Computed):
+class EODFit(Profiled, dj.Computed):
     definition = """
     ->EFishes
     ->NoHarmonics
@@ -208,9 +250,10 @@ class EODFit(dj.Computed):
             print('Found no entry in Runs() * Runs.GlobalEOD() for key', key)
             return
         dat = (Runs() * Runs.GlobalEOD() & key).fetch.limit(1).as_dict()[0]  # get some EOD trace
+        global_voltage = Runs.GlobalEOD().load_trace(dat)
 
-        w0 = estimate_fundamental(dat['global_voltage'], dat['samplingrate'], highcut=3000, normalize=.5)
-        t, win = get_best_time_window(dat['global_voltage'], dat['samplingrate'], w0, eod_cycles=10)
+        w0 = estimate_fundamental(global_voltage, dat['samplingrate'], highcut=3000, normalize=.5)
+        t, win = get_best_time_window(global_voltage, dat['samplingrate'], w0, eod_cycles=10)
 
         fundamental = estimate_fundamental(win, dat['samplingrate'], highcut=3000)
         assert abs(fundamental - dat['eod']) < 2, \
@@ -281,7 +324,7 @@ class EODFit(dj.Computed):
 
 
 @schema
-class LIFPUnit(dj.Computed):
+class LIFPUnit(Profiled, dj.Computed):
     definition = """
     # parameters for a LIF P-Unit simulation
 
@@ -298,45 +341,57 @@ class LIFPUnit(dj.Computed):
     reset           : double
     lif_tau         : double
     """
+    engine = 'lfilter'  # 'lfilter' or 'odeint'
 
     def _make_tuples(self, key):
         eod = (EODFit() & key).fetch1['fundamental']
-        self.insert1(dict(key, id='nwgimproved',
-                          zeta=0.2,
-                          tau=0.002,
-                          resonant_freq=eod,
-                          gain=70,
-                          offset=9,
-                          noise_sd=30,
-                          threshold=14.,
-                          reset=0.,
-                          lif_tau=0.001
-                          ))
-
-    def simulate(self, key, n, t, stimulus, y0=None):
+        self.insert1(dict(key, id='nwgimproved', resonant_freq=eod, **NWG_IMPROVED))
+
+    def drive(self, key, t, stimulus, y0=None):
+        """
+        Input of the LIF, i.e. the rectified and low-pass filtered resonator minus the offset. It does not depend on
+        the noise, so it can be recomputed at any time.
+
+        :param key: key that uniquely identifies a setting
+        :param t: equidistant time array
+        :param stimulus: stimulus as a function of time (function handle), evaluated on arrays of time points
+        :param y0: initial position and velocity of the resonator and initial low-pass state; zero if None
+        :return: input of the LIF at the times t
+        """
+        zeta, tau, gain, wr, offset = (self & key).fetch1['zeta', 'tau', 'gain', 'resonant_freq', 'offset']
+        w0, alpha = resonator_constants(wr, zeta)
+        return punit_drive(stimulus(t), t[1] - t[0], zeta, w0, gain, alpha, tau, y0=y0) - offset
+
+    def simulate(self, key, n, t, stimulus, y0=None, rng=None):
         """
         Samples spikes from leaky integrate and fire neuron with id==settings_name and time t.
-        Returns n trials
+        Returns n trials. The class attribute engine selects the discretized filters of locking.lif ('lfilter')
+        or the original odeint integration and per-step loop ('odeint').
 
         :param key: key that uniquely identifies a setting
         :param n: number of trials
-        :param t: time array
-        :param stimulus: stimulus as a function of time (function handle)
-        :return: spike times
+        :param t: equidistant time array
+        :param stimulus: stimulus as a function of time (function handle), evaluated on arrays of time points
+        :param y0: initial position and velocity of the resonator and initial low-pass state; zero if None
+        :param rng: np.random.Generator of the noise, the global np.random state if None
+        :return: spike times, input of the LIF
         """
 
         # --- get parameters from database
         zeta, tau, gain, wr, lif_tau, offset, threshold, reset, noisesd = (self & key).fetch1[
             'zeta', 'tau', 'gain', 'resonant_freq', 'lif_tau', 'offset', 'threshold', 'reset', 'noise_sd']
-        wr *= 2 * np.pi
-        w0 = wr / np.sqrt(1 - 2 * zeta ** 2)
-        Zm = np.sqrt((2 * w0 * zeta) ** 2 + (wr ** 2 - w0 ** 2) ** 2 / wr ** 2)
-        alpha = wr * Zm
+        w0, alpha = resonator_constants(wr, zeta)
 
         # --- set initial values if not given
         if y0 is None:
             y0 = np.zeros(3)
 
+        dt = t[1] - t[0]
+        if self.engine == 'lfilter':
+            Vin = self.drive(key, t, stimulus, y0=y0)
+            spikes = lif(Vin, t, n, lif_tau, threshold, reset, noisesd, rng=rng)
+            return tuple(spikes), Vin
+
         # --- differential equations for resonantor
         def _d(y, t):
             return np.array([
@@ -346,8 +401,6 @@ class LIFPUnit(dj.Computed):
             ])
 
         # --- simulate LIF
-        dt = t[1] - t[0]
-
         Vin = odeint(lambda y, tt: _d(y, tt), y0, t).T[2]
         Vin -= offset
 
@@ -356,9 +409,10 @@ class LIFPUnit(dj.Computed):
         ret = [list() for _ in range(n)]
 
         sdB = np.sqrt(dt) * noisesd
+        rng = np.random if rng is None else rng
 
         for i, T in enumerate(t):
-            Vout += (-Vout + Vin[i]) * dt / lif_tau + np.random.randn(n) * sdB
+            Vout += (-Vout + Vin[i]) * dt / lif_tau + rng.standard_normal(n) * sdB
             idx = Vout > threshold
             for j in np.where(idx)[0]:
                 ret[j].append(T)
@@ -376,7 +430,7 @@ class HarmonicStimulation(dj.Lookup):
     contents = [(0,),(1,)]
 
 @schema
-class PUnitSimulations(dj.Computed):
+class PUnitSimulations(Profiled, dj.Computed):
     definition = """
     # LIF simulations
 
@@ -386,7 +440,10 @@ class PUnitSimulations(dj.Computed):
     ---
     dt                    : double # time resolution for differential equation
     duration              : double # duration of trial in seconds
+    recording             : enum('full', 'float32', 'decimated', 'spectrum', 'none') # representation of the signals
+    recording_rate        : double # sampling rate of the stored signals in Hz, see record_signal
     """
+    recording = 'full'  # 'full', 'float32', 'decimated', 'spectrum', or 'none', see record_signal
 
     @property
     def key_source(self):
@@ -400,26 +457,13 @@ class PUnitSimulations(dj.Computed):
         ikey['dt'] = dt
         ikey['duration'] = duration
 
-        eod = (EODFit() & key).fetch1['fundamental']
-
-        delta_f = (Runs() & key).fetch1['delta_f']
-        other_eod = eod + delta_f
-
         t = np.arange(0, duration, dt)
-
-        baseline = EODFit().eod_func(key)
-        if key['harmonic_stimulation'] == 1:
-            foreign_eod = EODFit().eod_func(dict(fish_id='2014lepto0021'), fundamental=other_eod)
-        else:
-            foreign_eod = EODFit().eod_func(dict(fish_id='2014lepto0021'), fundamental=other_eod, harmonics=0)
-
+        baseline, stimulus = self.stimuli(key, t)
         bl = baseline(t)
-        foreign = foreign_eod(t)
-        fac = (bl.max() - bl.min()) * 0.2 / (foreign.max() - foreign.min())
-        stimulus = lambda tt: baseline(tt) + fac * foreign_eod(tt)
-        
-        spikes_base, membran_base = LIFPUnit().simulate(key, trials, t, baseline)
-        spikes_stim, membran_stim = LIFPUnit().simulate(key, trials, t, stimulus)
+
+        baseline_rng, stimulus_rng = spawn_generators(key_seed(self, key), 2)
+        spikes_base, membran_base = LIFPUnit().simulate(key, trials, t, baseline, rng=baseline_rng)
+        spikes_stim, membran_stim = LIFPUnit().simulate(key, trials, t, stimulus, rng=stimulus_rng)
 
         n = int(duration / dt)
         w = np.fft.fftfreq(n, d=dt)
@@ -427,16 +471,24 @@ class PUnitSimulations(dj.Computed):
         vs = np.mean([circ.event_series.direct_vector_strength_spectrum(sp, w) for sp in spikes_stim], axis=0)
         ci = second_order_critical_vector_strength(spikes_stim)
 
+        ikey['recording'] = self.recording
+        ikey['recording_rate'] = 1 / dt
+        signals = []
+        if self.recording != 'none':
+            for part, x in [('BaselineMembranePotential', membran_base), ('StimulusMembranePotential', membran_stim),
+                            ('Baseline', bl), ('Stimulus', stimulus(t))]:
+                stored, ikey['recording_rate'] = record_signal(x, dt, self.recording)
+                signals.append((part, stored))
+
         self.insert1(ikey)
 
         for i, (bsp, ssp) in enumerate(zip(spikes_base, spikes_stim)):
             PUnitSimulations.BaselineSpikes().insert1(dict(key, trial_idx=i, times=bsp))
             PUnitSimulations.StimulusSpikes().insert1(dict(key, trial_idx=i, times=ssp))
 
-        PUnitSimulations.BaselineMembranePotential().insert1(dict(key, potential=membran_base))
-        PUnitSimulations.StimulusMembranePotential().insert1(dict(key, potential=membran_stim))
-        PUnitSimulations.Baseline().insert1(dict(key, signal=bl))
-        PUnitSimulations.Stimulus().insert1(dict(key, signal=stimulus(t)))
+        for part, stored in signals:
+            attribute = 'potential' if part.endswith('MembranePotential') else 'signal'
+            getattr(PUnitSimulations, part)().insert1(dict(key, **{attribute: stored}))
         PUnitSimulations.StimulusSecondOrderSpectrum().insert1(dict(key, spectrum=vs, ci=ci, freq=w))
 
     class BaselineSpikes(dj.Part):
@@ -506,16 +558,58 @@ class PUnitSimulations(dj.Computed):
         signal       : longblob # membrane potential
         """
 
+    def stimuli(self, key, t):
+        """
+        Baseline EOD and stimulus (baseline plus foreign EOD at 20% contrast) of a simulation.
+
+        :param key: key of PUnitSimulations
+        :param t: time points, used to scale the foreign EOD
+        :return: baseline, stimulus as functions of time
+        """
+        eod = (EODFit() & key).fetch1['fundamental']
+
+        delta_f = (Runs() & key).fetch1['delta_f']
+        other_eod = eod + delta_f
+
+        baseline = EODFit().eod_func(key)
+        if key['harmonic_stimulation'] == 1:
+            foreign_eod = EODFit().eod_func(dict(fish_id='2014lepto0021'), fundamental=other_eod)
+        else:
+            foreign_eod = EODFit().eod_func(dict(fish_id='2014lepto0021'), fundamental=other_eod, harmonics=0)
+
+        bl = baseline(t)
+        foreign = foreign_eod(t)
+        fac = (bl.max() - bl.min()) * 0.2 / (foreign.max() - foreign.min())
+        return baseline, lambda tt: baseline(tt) + fac * foreign_eod(tt)
+
+    def amplitude_spectrum(self, key, signal):
+        """
+        Amplitude spectrum of a simulated signal from whichever representation was stored. Signals that were not
+        recorded are computed again; they do not depend on the noise of the LIF.
+
+        :param key: key of PUnitSimulations
+        :param signal: 'Baseline', 'Stimulus', 'BaselineMembranePotential', or 'StimulusMembranePotential'
+        :return: frequencies >= 0, amplitudes
+        """
+        dt, duration, recording, rate = (self & key).fetch1['dt', 'duration', 'recording', 'recording_rate']
+        t = np.arange(0, duration, dt)
+        membrane_potential = signal.endswith('MembranePotential')
+        if recording == 'none':
+            baseline, stimulus = self.stimuli(key, t)
+            source = baseline if signal.startswith('Baseline') else stimulus
+            stored = LIFPUnit().drive(key, t, source) if membrane_potential else source(t)
+            recording = 'full'
+        else:
+            stored = (getattr(PUnitSimulations, signal)() & key).fetch1[
+                'potential' if membrane_potential else 'signal']
+        return recorded_spectrum(stored, rate, len(t), recording)
+
     def plot_stimulus_spectrum(self, key, ax, f_max=2000):
-        dt = (self & key).fetch1['dt']
         eod = (EODFit() & key).fetch1['fundamental']
         fstim = eod + (Runs() & key).fetch1['delta_f']
 
-        stimulus_signal = (PUnitSimulations.Stimulus() & key).fetch1['signal']
-        w = np.fft.fftfreq(len(stimulus_signal), d=dt)
+        w, S = self.amplitude_spectrum(key, 'Stimulus')
         idx = (w > 0) & (w < f_max)
-
-        S = np.abs(np.fft.fft(stimulus_signal))
         S /= S.max()
 
         ax.fill_between(w[idx], 0 * w[idx], S[idx], color='darkslategray')
@@ -558,12 +652,10 @@ class PUnitSimulations(dj.Computed):
         ax.set_xlim((0, f_max))
 
     def plot_membrane_potential_spectrum(self, key, ax, f_max=2000):
-        dt = (self & key).fetch1['dt']
         eod = (EODFit() & key).fetch1['fundamental']
         fstim = eod + (Runs() & key).fetch1['delta_f']
 
-        membrane_potential = (PUnitSimulations.StimulusMembranePotential() & key).fetch1['potential']
-        w = np.fft.fftfreq(len(membrane_potential), d=dt)
+        w, M = self.amplitude_spectrum(key, 'StimulusMembranePotential')
         idx = (w > 0) & (w < f_max)
 
         # fig, ax = plt.subplots()
@@ -574,7 +666,6 @@ class PUnitSimulations(dj.Computed):
         # # ax.twinx().plot(stimulus_signal[5000:8000],'-r')
         # plt.show()
 
-        M = np.abs(np.fft.fft(membrane_potential))
         M /= M[idx].max()
         ax.fill_between(w[idx], 0 * w[idx], M[idx], color='darkslategray')
         ax.set_ylim((0, 1.5))
@@ -624,13 +715,132 @@ class PUnitSimulations(dj.Computed):
         ax.set_label('time [EOD cycles]')
 
 
+def migrate_punit_simulations():
+    """
+    Adds the recording and recording_rate attributes to a PUnitSimulations table declared before they existed.
+    Existing simulations were stored in full at the time resolution of the simulation.
+    """
+    table = PUnitSimulations()
+    add_columns(table, [
+        ('recording', 'enum("full","float32","decimated","spectrum","none") NOT NULL DEFAULT "full" '
+                      'COMMENT "representation of the signals"'),
+        ('recording_rate', 'double NOT NULL COMMENT "sampling rate of the stored signals in Hz, see record_signal"')])
+    table.connection.query('UPDATE {table} SET recording_rate = 1 / dt WHERE recording_rate = 0'.format(
+        table=table.full_table_name))
+
+
+def parameter_grid(sweep_id, **values):
+    """
+    Contents of LIFParameterSweep.ParameterSet for the full grid over the given parameter values. Parameters
+    that are not given are taken from NWG_IMPROVED.
+
+    :param sweep_id: name of the sweep in LIFParameterSweep
+    :param values: list of values for some of the parameters in NWG_IMPROVED
+    :return: list of dictionaries with sweep_id, param_id, and the parameters
+    """
+    names = sorted(values)
+    return [dict(NWG_IMPROVED, sweep_id=sweep_id, param_id=i, **dict(zip(names, combination)))
+            for i, combination in enumerate(itertools.product(*(values[k] for k in names)))]
+
+
+@schema
+class LIFParameterSweep(dj.Lookup):
+    definition = """
+    # grid of LIF P-unit parameter sets that are simulated together
+
+    sweep_id        : varchar(100)  # name of the sweep
+    ---
+    n_trials        : int           # number of trials per parameter set
+    duration        : double        # duration of a trial in s
+    dt              : double        # time resolution of the simulation in s
+    delta_f         : double        # frequency of the foreign EOD relative to the EOD in Hz
+    contrast        : double        # peak to peak amplitude of the foreign EOD relative to the EOD
+    """
+
+    contents = [
+        dict(sweep_id='nwgimproved_grid', n_trials=20, duration=1., dt=0.000005, delta_f=-300, contrast=0.2),
+    ]
+
+    class ParameterSet(dj.Part):
+        definition = """
+        # one parameter set of the sweep
+
+        -> LIFParameterSweep
+        param_id        : int       # index of the parameter set
+        ---
+        zeta            : double
+        tau             : double
+        gain            : double
+        offset          : double
+        noise_sd        : double
+        threshold       : double
+        reset           : double
+        lif_tau         : double
+        """
+
+        contents = parameter_grid('nwgimproved_grid', zeta=(0.1, 0.2, 0.3), gain=(50, 70, 90),
+                                  noise_sd=(20, 30, 40), threshold=(12., 14., 16.), lif_tau=(0.0005, 0.001, 0.002))
+
+
+@schema
+class LIFSweepSummary(Profiled, dj.Computed):
+    definition = """
+    # summary statistics of the simulated spike trains of all parameter sets of a sweep
+
+    -> LIFParameterSweep
+    -> EODFit
+    ---
+    isi_bins        : longblob  # edges of the ISI histograms in EOD cycles
+    """
+
+    class Summary(dj.Part):
+        definition = """
+        -> LIFSweepSummary
+        -> LIFParameterSweep.ParameterSet
+        ---
+        firing_rate     : double    # mean firing rate in Hz
+        isi_histogram   : longblob  # fraction of the interspike intervals in the bins of isi_bins
+        vs_eod=null     : double    # mean vector strength over trials with spikes at the EOD frequency, NULL if none
+        vs_stimulus=null : double   # mean vector strength over trials with spikes at the stimulus frequency, NULL if none
+        """
+
+    def _make_tuples(self, key):
+        print('Populating', dict(key))
+        n_trials, duration, dt, delta_f, contrast = (LIFParameterSweep() & key).fetch1[
+            'n_trials', 'duration', 'dt', 'delta_f', 'contrast']
+        eod = (EODFit() & key).fetch1['fundamental']
+        t = np.arange(0, duration, dt)
+
+        baseline = EODFit().eod_func(key)(t)
+        foreign = EODFit().eod_func(dict(fish_id='2014lepto0021'), fundamental=eod + delta_f)(t)
+        stimulus = baseline + foreign * contrast * np.ptp(baseline) / np.ptp(foreign)
+
+        # parameter sets with the same lif_tau are simulated as one batch, so they are kept together in a task
+        parameter_sets = (LIFParameterSweep.ParameterSet() & key).fetch.as_dict()
+        parameter_sets = sorted(parameter_sets, key=lambda p: (p['lif_tau'], p['param_id']))
+        tasks = [parameter_sets[i:i + SWEEP_BATCH_SIZE] for i in range(0, len(parameter_sets), SWEEP_BATCH_SIZE)]
+        seed = key_seed(self, key)
+
+        processes = min(SWEEP_PROCESSES or multiprocessing.cpu_count(), len(tasks))
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            results = pool.starmap(summarize_parameter_sets, [
+                (stimulus, dt, eod, [eod, eod + delta_f], task, n_trials, SWEEP_ISI_BINS, task_seed)
+                for task, task_seed in zip(tasks, spawn_seeds(seed, len(tasks)))])
+
+        self.insert1(dict(key, isi_bins=SWEEP_ISI_BINS))
+        self.Summary().insert([
+            dict(key, param_id=p['param_id'], firing_rate=rate, isi_histogram=histogram,
+                 vs_eod=vs[0], vs_stimulus=vs[1])
+            for task, (rates, histograms, vector_strengths) in zip(tasks, results)
+            for p, rate, histogram, vs in zip(task, rates, histograms, vector_strengths)])
+
+
 @schema
 class RandomTrials(dj.Lookup):
     definition = """
     n_total                 : int # total number of trials
     repeat_id               : int # repeat number
     ---
-
     """
 
     class TrialSet(dj.Part):
@@ -667,14 +877,15 @@ class RandomTrials(dj.Lookup):
 
             for repeat_id in range(10):
                 key = dict(n_total=n_total, repeat_id=repeat_id)
+                rng = seed_generator(key_seed(self, key))
                 self.insert1(key, skip_duplicates=True)
-                for new_trial_id, trial_id in enumerate(np.random.randint(n, size=n_total)):
+                for new_trial_id, trial_id in enumerate(rng.integers(n, size=n_total)):
                     key['new_trial_id'] = new_trial_id
                     key.update(data[trial_id])
                     ts.insert1(key)
 
                 key = dict(n_total=n_total, repeat_id=repeat_id)
-                for new_trial_id, ix in enumerate(np.random.randint(len(df), size=n_total)):
+                for new_trial_id, ix in enumerate(rng.integers(len(df), size=n_total)):
                     key['new_trial_id'] = new_trial_id
                     key.update(df.iloc[ix].to_dict())
                     ps.insert1(key)
@@ -686,7 +897,9 @@ class RandomTrials(dj.Lookup):
             Phases = (RandomTrials.PhaseSet() * UncenteredPUnitPhases()).project('phase', phase_cell='cell_id')
         trials = Runs.SpikeTimes() * RandomTrials.TrialSet() * Phases * TrialAlign() & key
 
-        times, phase, align_times = trials.fetch['times', 'phase', 't0']
+        rows = fetch_cached(trials, 'times')
+        times = [row['times'] for row in rows]
+        phase, align_times = (np.array([row[k] for row in rows]) for k in ('phase', 't0'))
 
         dt = 1. / (Runs() & trials).fetch1['samplingrate']
 
@@ -739,7 +952,7 @@ class PyramidalSimulationParameters(dj.Lookup):
 
 
 @schema
-class PyramidalLIF(dj.Computed):
+class PyramidalLIF(Profiled, dj.Computed):
     definition = """
     ->RandomTrials
     ->PyramidalSimulationParameters
@@ -823,7 +1036,7 @@ class PyramidalLIF(dj.Computed):
 #
 
 @schema
-class LIFStimulusLocking(dj.Computed):
+class LIFStimulusLocking(Profiled, dj.Computed):
     definition = """
     -> PyramidalLIF                         # each run has a spectrum
     ---
@@ -916,25 +1129,24 @@ class LIFStimulusLocking(dj.Computed):
 
 
 
-def simple_lif(t, I, n=10, offset=0, amplitude=1, noisesd=30, threshold=15, reset=0, tau_neuron=0.01):
-    dt = t[1] - t[0]
-
-    I = amplitude * I + offset
-
-    Vout = np.ones(n) * reset
-
-    ret = [list() for _ in range(n)]
-
-    sdB = np.sqrt(dt) * noisesd
-    V = np.zeros((n, len(I)))
-    for i, t_step in enumerate(t):
-        Vout += (-Vout + I[i]) * dt / tau_neuron + np.random.randn(n) * sdB
-        idx = Vout > threshold
-        for j in np.where(idx)[0]:
-            ret[j].append(t_step)
-        Vout[idx] = reset
-        V[:, i] = Vout
-    return ret, V
+def simple_lif(t, I, n=10, offset=0, amplitude=1, noisesd=30, threshold=15, reset=0, tau_neuron=0.01, rng=None,
+               record_every=None):
+    """
+    Leaky integrate-and-fire neurons driven by amplitude * I + offset, starting at the reset potential. Time is
+    simulated in blocks for all trials at once by locking.lif.lif, so memory does not grow with the number of
+    time steps unless the membrane potential is recorded.
+
+    :param t: equidistant time points
+    :param I: input at the times t
+    :param n: number of trials
+    :param rng: np.random.Generator of the noise, the global np.random state if None
+    :param record_every: record the membrane potential every record_every time steps; not recorded if None
+    :return: spike times as SpikeTrains, membrane potential (trials x recorded steps) or None
+    """
+    drive = amplitude * np.asarray(I, dtype=np.float64) + offset
+    if record_every is None:
+        return lif(drive, t, n, tau_neuron, threshold, reset, noisesd, v0=reset, rng=rng), None
+    return lif(drive, t, n, tau_neuron, threshold, reset, noisesd, v0=reset, rng=rng, record_every=record_every)
 
 
 if __name__ == '__main__':
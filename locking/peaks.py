@@ -0,0 +1,282 @@
+import sys
+
+import numpy as np
+
+PEAKDET_CHUNK_SIZE = 2 ** 16
+SEARCH_DISTANCE = 2 ** 4 - 1
+COMBINATION_COEFFICIENTS = np.arange(-5, 6)  # multiples of every frequency in a combination lattice
+
+
+def peakdet(v, delta=None, chunk_size=PEAKDET_CHUNK_SIZE):
+    """
+    Peak detection. Modified version from https://gist.github.com/endolith/250860
+
+    A point counts as peak if it is maximal and is preceeded by a value lower by delta.
+
+    The trace is processed in chunks of chunk_size samples by a PeakDetector. The result is identical
+    index-for-index to the original sample-wise loop. Since only one chunk is read at a time, v can be a
+    numpy.memmap of arbitrary length.
+
+    :param v: array of values
+    :param delta: threshold; set to 99.9%ile - median of v if None
+    :param chunk_size: number of samples that are processed at once
+    :return: maxima, maximum indices, minima, minimum indices
+    """
+    v = np.asarray(v)
+    if delta is None:
+        delta = default_delta(v)
+
+    detector = PeakDetector(delta)
+    extrema = [detector.update(v[offset:offset + chunk_size]) for offset in range(0, len(v), chunk_size)]
+    if len(extrema) == 0:
+        return np.asarray([]), np.asarray([], dtype=int), np.asarray([]), np.asarray([], dtype=int)
+    return tuple(np.hstack(e) for e in zip(*extrema))
+
+
+def default_delta(v):
+    """
+    Default threshold of peakdet: 99.9%ile - median of the absolute values of the first 100000 samples.
+
+    :param v: array of values
+    :return: threshold
+    """
+    up = int(np.min([1e5, len(v)]))
+    tmp = np.abs(v[:up])
+    return np.percentile(tmp, 99.9) - np.percentile(tmp, 50)
+
+
+class PeakDetector:
+    """
+    Streaming form of peakdet. The trace is passed in consecutive chunks to update, which returns the
+    peaks and troughs that are complete after that chunk. The state of the hysteresis is kept between
+    chunks, so the concatenated results are identical to peakdet on the whole trace while memory only
+    depends on the chunk size.
+
+    Example::
+
+        detector = PeakDetector(delta)
+        for chunk in chunks:
+            maxtab, maxidx, mintab, minidx = detector.update(chunk)
+    """
+
+    def __init__(self, delta):
+        if not np.isscalar(delta):
+            sys.exit('Input argument delta must be a scalar')
+
+        if delta <= 0:
+            sys.exit('Input argument delta must be positive')
+
+        self.delta = delta
+        self.offset = 0  # number of samples seen so far
+        self.state = None
+
+    def update(self, chunk):
+        """
+        Processes the next chunk of the trace.
+
+        :param chunk: array of values that continues the samples passed so far
+        :return: maxima, maximum indices, minima, minimum indices (indices refer to the whole trace)
+        """
+        chunk = np.asarray(chunk)
+        if len(chunk) == 0:
+            return chunk[:0], np.zeros(0, dtype=int), chunk[:0], np.zeros(0, dtype=int)
+        ret = _peakdet_chunk(chunk, self.offset, self.delta, self.state)
+        self.state = ret[-1]
+        self.offset += len(chunk)
+        return ret[:-1]
+
+
+def _peakdet_chunk(chunk, offset, delta, state=None):
+    """
+    Runs the delta-hysteresis of peakdet on one chunk of a trace.
+
+    While looking for a maximum that started at sample a, the search ends at the first sample j with
+    v[j] < max(v[a:j]) - delta. Let L(j) be the last index i < j with v[i] - delta > v[j]. Then the search
+    ends at the first j with L(j) >= a. L is computed for all samples at once by binary lifting over a
+    sparse table of range maxima, and the end of a search is found by a binary search in the running
+    maximum of L. Troughs are found in the same way with minima and +delta. Only the hops from one
+    extremum to the next remain a python loop.
+
+    The phase of the hysteresis and the running extremum are carried between chunks by prepending the
+    running extremum to the next chunk.
+
+    :param chunk: array of values
+    :param offset: index of the first sample of chunk in the trace
+    :param delta: threshold
+    :param state: state returned by the previous chunk, None for the first chunk
+    :return: maxima, maximum indices, minima, minimum indices, state
+    """
+    if state is None:
+        lookformax = True
+        x, pos = chunk, offset + np.arange(len(chunk))
+    else:
+        lookformax, value, idx = state
+        x = np.hstack((np.asarray([value], dtype=chunk.dtype), chunk))
+        pos = np.hstack(([idx], offset + np.arange(len(chunk))))
+
+    # samples that repeat the previous value or lie on a monotonic flank do not change which extrema are
+    # found, so only the turning points of the trace are passed on
+    keep = _turning_points(x)
+    x, pos = x[keep], pos[keep]
+
+    m = len(x)
+    u, w = x - delta, x + delta  # same rounding as mx - delta and mn + delta in the sample-wise loop
+    end_max = _search_end(u, x, np.maximum, np.greater).tolist()
+    end_min = _search_end(w, x, np.minimum, np.less).tolist()
+
+    starts, phases = [0], [lookformax]
+    while True:
+        a = starts[-1]
+        if phases[-1]:
+            nxt = end_max[a]
+            if nxt - a > SEARCH_DISTANCE:
+                nxt = _search_end_slow(u[a:], x[a:], np.maximum.accumulate, np.greater) + a
+        else:
+            nxt = end_min[a]
+            if nxt - a > SEARCH_DISTANCE:
+                nxt = _search_end_slow(w[a:], x[a:], np.minimum.accumulate, np.less) + a
+        if nxt >= m:
+            break
+        starts.append(nxt)
+        phases.append(not phases[-1])
+
+    # extremum of each segment; the last segment is still open and goes into the state
+    starts = np.asarray(starts)
+    phases = np.asarray(phases)
+    target = np.where(phases, np.maximum.reduceat(x, starts), np.minimum.reduceat(x, starts))
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.hstack((starts, m))))
+    hit = np.flatnonzero(x == target[segment])
+    _, first = np.unique(segment[hit], return_index=True)
+    extrema = hit[first]
+
+    state = (bool(phases[-1]), x[extrema[-1]], pos[extrema[-1]])
+    values, extrema, phases = x[extrema[:-1]], pos[extrema[:-1]], phases[:-1]
+    return values[phases], extrema[phases], values[~phases], extrema[~phases], state
+
+
+def _search_end(shifted, x, reduce, compare):
+    """
+    For every index a, computes the first j > a with compare(shifted[i], x[j]) for some a <= i < j,
+    or len(x) if there is no such j. Only i >= j - SEARCH_DISTANCE are considered, which makes the result
+    exact whenever it is at most SEARCH_DISTANCE samples away from a.
+    """
+    m = len(x)
+    # sparse table: table[k][i] = reduce(shifted[i:i + 2 ** k])
+    table = [shifted]
+    while 2 ** len(table) <= min(m, SEARCH_DISTANCE + 1):
+        h = 2 ** (len(table) - 1)
+        table.append(reduce(table[-1][:-h], table[-1][h:]))
+
+    # last = L(j): largest i < j with compare(shifted[i], x[j]) found by binary lifting, -1 if there is none
+    last = np.arange(m)
+    for k in range(len(table) - 1, -1, -1):
+        cand = last - 2 ** k
+        ok = cand >= 0
+        move = ok & ~compare(table[k][np.where(ok, cand, 0)], x)
+        last = np.where(move, cand, last)
+    last -= 1
+    last[~compare(shifted[np.maximum(last, 0)], x)] = -1
+
+    # the end for a is the first j whose running maximum of L reaches a
+    return np.searchsorted(np.maximum.accumulate(last), np.arange(m), side='left')
+
+
+def _search_end_slow(shifted, x, accumulate, compare):
+    """
+    Same as _search_end for a=0 only, without limit on the search distance. The trace is scanned in
+    windows of growing size.
+    """
+    start, window = 0, 2 * SEARCH_DISTANCE
+    bound = shifted[:1]
+    while start < len(x):
+        stop = min(start + window, len(x))
+        acc = accumulate(np.hstack((bound, shifted[start:stop])))[1:]
+        hit = np.flatnonzero(compare(acc, x[start:stop]))
+        if len(hit) > 0:
+            return start + hit[0]
+        start, window, bound = stop, 2 * window, acc[-1:]
+    return len(x)
+
+
+def _turning_points(x):
+    """
+    Indices of the samples in x at which the trace changes direction. Of a run of equal values only the
+    first sample is considered. The first and the last of these samples are always included.
+    """
+    new = np.ones(len(x), dtype=bool)
+    np.not_equal(x[1:], x[:-1], out=new[1:])
+    idx = np.flatnonzero(new)
+
+    rising = x[idx[1:]] > x[idx[:-1]]
+    turn = np.ones(len(idx), dtype=bool)
+    np.not_equal(rising[1:], rising[:-1], out=turn[1:-1])
+    return idx[turn]
+
+
+def nearest_distance(x, reference):
+    """
+    Distance of every element of x to the closest element of reference. Equivalent to
+    np.abs(reference[:, None] - x[None, :]).min(axis=0), but with O(n log n) time and O(n) memory.
+
+    :param x: array of values, e.g. peak indices
+    :param reference: array of values to compare to
+    :return: array of distances with the shape of x
+    """
+    x = np.asarray(x)
+    reference = np.sort(np.asarray(reference))
+    if len(reference) == 0:
+        raise ValueError('reference must not be empty')
+    idx = np.searchsorted(reference, x)
+    left = reference[np.maximum(idx - 1, 0)]
+    right = reference[np.minimum(idx, len(reference) - 1)]
+    return np.minimum(np.abs(x - left), np.abs(right - x))
+
+
+def coincident(x, reference, tol):
+    """
+    Marks the elements of x that lie within tol of an element of reference.
+
+    :param x: array of values, e.g. EOD peak indices
+    :param reference: array of values, e.g. stimulus peak indices
+    :param tol: tolerance
+    :return: boolean array with the shape of x
+    """
+    return nearest_distance(x, reference) <= tol
+
+
+def combination_lattice(frequencies, coefficients, cutoff):
+    """
+    All integer combinations sum_i c_i * frequencies[i] with c_i from coefficients[i] and absolute value
+    below or equal to cutoff, sorted by frequency.
+
+    :param frequencies: base frequencies, e.g. stimulus, EOD, and baseline firing rate
+    :param coefficients: one array of multiples per base frequency
+    :param cutoff: largest absolute combination frequency
+    :return: sorted combination frequencies, coefficients of every combination (one row each), and the position
+             of every combination in the order of itertools.product(*coefficients)
+    """
+    grids = np.meshgrid(*[np.asarray(c) for c in coefficients], indexing='ij')
+    facs = np.stack([g.ravel() for g in grids], axis=1)  # rows in the order of itertools.product
+    combined = np.dot(facs, np.asarray(frequencies, dtype=np.float64))
+    position = np.flatnonzero(np.abs(combined) <= cutoff)
+    position = position[np.argsort(combined[position], kind='stable')]
+    return combined[position], facs[position], position
+
+
+def lattice_matches(x, lattice, tol):
+    """
+    All pairs of elements of x and of a sorted lattice that are closer than tol.
+
+    :param x: array of values, e.g. peak frequencies
+    :param lattice: sorted array, e.g. frequencies returned by combination_lattice
+    :param tol: tolerance
+    :return: index into x and index into lattice of every pair, sorted by the index into x
+    """
+    x = np.asarray(x, dtype=np.float64)
+    lo = np.searchsorted(lattice, x - tol, side='left')
+    hi = np.searchsorted(lattice, x + tol, side='right')
+    counts = hi - lo
+    i = np.repeat(np.arange(len(x)), counts)
+    j = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+    close = np.abs(x[i] - lattice[j]) < tol  # searchsorted brackets the candidates, the test is exact
+    return i[close], j[close]
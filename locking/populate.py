@@ -0,0 +1,370 @@
+"""
+Command line driver that populates the tables of a pipeline with several worker processes per table.
+
+Example::
+
+    locking populate data -j 8
+    locking populate analyses -j 8 --schedule
+    locking reimport -j 8
+    locking populate analyses -j 8 --profile && locking profile
+"""
+import argparse
+import importlib
+import multiprocessing
+import sys
+from collections import OrderedDict
+from time import sleep, time
+
+# Tables in the order they have to be populated. Each entry is (module in locking, table, class attributes that
+# are set in the workers before populating).
+PIPELINES = {
+    'data': [
+        ('data', 'EFishes', {}),
+        ('data', 'Cells', {}),
+        ('data', 'FICurves', {}),
+        ('data', 'ISIHistograms', {}),
+        ('data', 'Baseline', {}),
+        ('data', 'Runs', dict(extract_peaks=True)),
+        ('data', 'GlobalEFieldPeaksTroughs', {}),
+        ('data', 'GlobalEODPeaksTroughs', {}),
+        ('data', 'LocalEODPeaksTroughs', {}),
+        ('data', 'PUnitPhases', {}),
+        ('data', 'BaseRate', {}),
+        ('data', 'BaseEOD', {}),
+        ('sanity', 'SpikeCheck', {}),
+    ],
+    'analyses': [
+        ('analyses', 'TrialAlign', {}),
+        ('analyses', 'FirstOrderSpikeSpectra', dict(per_cell=True)),
+        ('analyses', 'FirstOrderSignificantPeaks', {}),
+        ('analyses', 'SecondOrderSpikeSpectra', dict(per_cell=True)),
+        ('analyses', 'SecondOrderSignificantPeaks', {}),
+        ('analyses', 'StimulusSpikeJitter', {}),
+        ('analyses', 'PhaseLockingHistogram', {}),
+        ('analyses', 'EODStimulusPSTSpikes', {}),
+        ('analyses', 'Decoding', dict(per_cell=True)),
+        ('analyses', 'BaselineSpikeJitter', {}),
+    ],
+}
+
+# Tables that a table reads in its key_source or _make_tuples without a foreign key to them. The scheduler only
+# starts such a table once these are complete, because a partially populated upstream table would silently
+# change its results.
+HIDDEN_DEPENDENCIES = {
+    'analyses': {
+        'FirstOrderSpikeSpectra': ['TrialAlign'],
+        'FirstOrderSignificantPeaks': ['TrialAlign'],
+        'StimulusSpikeJitter': ['TrialAlign', 'SecondOrderSignificantPeaks'],
+        'PhaseLockingHistogram': ['TrialAlign'],
+    },
+}
+
+POLL_INTERVAL = 1  # seconds between checks of the workers by the scheduler
+REPOPULATE_INTERVAL = 30  # seconds between passes over a table whose upstream tables are still being populated
+PROGRESS_INTERVAL = 30  # seconds between progress summaries of the scheduler
+
+
+def get_table(module, table, attributes=None):
+    """
+    Imports a table class from a module of locking.
+
+    :param module: name of the module, e.g. 'data'
+    :param table: name of the table class
+    :param attributes: class attributes to set
+    :return: table class
+    """
+    rel = getattr(importlib.import_module('locking.' + module), table)
+    for name, value in (attributes or {}).items():
+        setattr(rel, name, value)
+    return rel
+
+
+def populate_worker(module, table, attributes):
+    """
+    Populates a table in a worker process. Keys are reserved in the jobs table, so several workers can
+    populate the same table.
+
+    :return: list of (key, error message) for the keys that failed
+    """
+    errors = get_table(module, table, attributes)().populate(reserve_jobs=True, suppress_errors=True,
+                                                             order='random')
+    return [(key, ': '.join([error.__class__.__name__, str(error)]).strip(': ')) for key, error in errors]
+
+
+def populate_table(module, table, attributes, processes):
+    """
+    Populates a table with several worker processes and waits for all of them.
+
+    :param module: name of the module in locking
+    :param table: name of the table class
+    :param attributes: class attributes that are set in the workers
+    :param processes: number of worker processes
+    :return: dictionary with number of populated keys, remaining keys, elapsed time, and failures
+    """
+    rel = get_table(module, table, attributes)()
+    remaining, total = rel.progress(display=False)
+
+    t0 = time()
+    errors = []
+    # workers are spawned instead of forked, so that every worker opens its own database connection
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        results = [pool.apply_async(populate_worker, (module, table, attributes)) for _ in range(processes)]
+        for result in results:
+            try:
+                errors.extend(result.get())
+            except Exception as error:  # the worker died
+                errors.append((None, ': '.join([error.__class__.__name__, str(error)]).strip(': ')))
+    elapsed = time() - t0
+
+    left, total = rel.progress(display=False)
+    return dict(table=table, populated=remaining - left, remaining=left, total=total, elapsed=elapsed,
+                errors=errors)
+
+
+def print_report(stats):
+    """
+    Prints throughput and failures per table.
+
+    :param stats: list of dictionaries returned by populate_table
+    """
+    print('\n%-28s %10s %10s %10s %10s %10s' % ('table', 'populated', 'remaining', 'failed', 'time [s]', 'keys/s'))
+    for s in stats:
+        print('%-28s %10i %10i %10i %10.1f %10.2f' % (s['table'], s['populated'], s['remaining'], len(s['errors']),
+                                                       s['elapsed'], s['populated'] / max(s['elapsed'], 1e-9)))
+    for s in stats:
+        for key, message in s['errors']:
+            print('%s failed for %s: %s' % (s['table'], key if key is not None else 'worker', message))
+
+
+def populate(pipeline, processes=1, tables=None, profile=False):
+    """
+    Populates the tables of a pipeline in order, each with several worker processes. A table is only started
+    after all workers of the previous table have finished, so its dependencies are complete.
+
+    :param pipeline: name of the pipeline in PIPELINES
+    :param processes: number of worker processes per table
+    :param tables: optional list of table names to restrict the pipeline to
+    :param profile: record the resources of every key in profiling.MakeProfile
+    :return: list of dictionaries returned by populate_table
+    """
+    stats = []
+    for module, table, attributes in PIPELINES[pipeline]:
+        if tables is not None and table not in tables:
+            continue
+        if profile:
+            attributes = dict(attributes, profile=True)
+        print('Populating', table, 'with', processes, 'processes', flush=True)
+        stats.append(populate_table(module, table, attributes, processes))
+    print_report(stats)
+    return stats
+
+
+def pipeline_graph(pipeline, tables=None):
+    """
+    Upstream tables of every table in a pipeline, read from the foreign keys in the DataJoint dependency graph
+    and from HIDDEN_DEPENDENCIES. A foreign key to a part table counts as a dependency on its master.
+
+    :param pipeline: name of the pipeline in PIPELINES
+    :param tables: optional list of table names to restrict the pipeline to
+    :return: dictionary table -> set of upstream tables connected by foreign keys, dictionary table -> set of
+             upstream tables that have to be complete before the table is started
+    """
+    import networkx as nx
+    rels = OrderedDict((table, get_table(module, table, attributes)())
+                       for module, table, attributes in PIPELINES[pipeline] if tables is None or table in tables)
+    if not rels:
+        return {}, {}
+    dependencies = next(iter(rels.values())).connection.dependencies
+    dependencies.load()
+
+    prefixes = {table: (rel.full_table_name, rel.full_table_name[:-1] + '__') for table, rel in rels.items()}
+    foreign, hidden = {}, {}
+    for table, rel in rels.items():
+        ancestors = nx.ancestors(dependencies, rel.full_table_name)
+        foreign[table] = {other for other, (name, part) in prefixes.items()
+                          if other != table and any(a == name or a.startswith(part) for a in ancestors)}
+        hidden[table] = set(HIDDEN_DEPENDENCIES.get(pipeline, {}).get(table, [])) & set(rels)
+    return foreign, hidden
+
+
+def print_progress(elapsed, state, counts, running, errors):
+    """
+    Prints one line per table with its state, populated and total keys, running workers, and failures.
+    """
+    print('\n[%8.1f s] %-28s %10s %10s %10s %10s' % (elapsed, 'table', 'state', 'populated', 'workers', 'failed'))
+    for table in state:
+        left, total = counts[table]
+        print('%12s %-28s %10s %10s %10i %10i' % ('', table, state[table], '%i/%i' % (total - left, total),
+                                                  running[table], len(errors[table])), flush=True)
+
+
+def schedule(pipeline, processes=1, tables=None, profile=False):
+    """
+    Populates the tables of a pipeline with one pool of worker processes, running independent tables
+    concurrently.
+
+    A table is started as soon as the tables in its HIDDEN_DEPENDENCIES are complete. While tables it depends on
+    by foreign keys are still running, one worker populates the keys whose upstream entries already exist and is
+    restarted every REPOPULATE_INTERVAL seconds. Once all of them are complete, all free workers populate the
+    table, and it is complete after a pass that started after its upstream tables were complete. A progress
+    summary is printed every PROGRESS_INTERVAL seconds.
+
+    :param pipeline: name of the pipeline in PIPELINES
+    :param processes: number of worker processes in the pool
+    :param tables: optional list of table names to restrict the pipeline to
+    :param profile: record the resources of every key in profiling.MakeProfile
+    :return: list of dictionaries like the ones returned by populate_table
+    """
+    entries = OrderedDict((table, (module, table, dict(attributes, profile=True) if profile else attributes))
+                          for module, table, attributes in PIPELINES[pipeline] if tables is None or table in tables)
+    foreign, hidden = pipeline_graph(pipeline, tables)
+    rels = {table: get_table(*entries[table])() for table in entries}
+
+    counts = {table: rels[table].progress(display=False) for table in entries}
+    initial = {table: counts[table][1] - counts[table][0] for table in entries}  # keys populated before
+    state = OrderedDict((table, 'waiting') for table in entries)
+    running = {table: 0 for table in entries}
+    last_pass = {table: -float('inf') for table in entries}
+    started, finished = {}, {}
+    errors = {table: [] for table in entries}
+    final = {table: False for table in entries}  # a pass started after all upstream tables were complete
+    tasks = []  # (table, pass started after upstream was complete, AsyncResult)
+
+    t0 = last_report = time()
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        while any(s != 'complete' for s in state.values()):
+            # collect finished passes
+            for task in [task for task in tasks if task[2].ready()]:
+                tasks.remove(task)
+                table, complete_upstream, result = task
+                running[table] -= 1
+                try:
+                    errors[table].extend(result.get())
+                except Exception as error:  # the worker died
+                    errors[table].append((None, ': '.join([error.__class__.__name__, str(error)]).strip(': ')))
+                final[table] |= complete_upstream
+                if final[table] and running[table] == 0:
+                    state[table] = 'complete'
+                    finished[table] = time()
+                    counts[table] = rels[table].progress(display=False)
+
+            # start passes on tables whose hidden dependencies are complete; every table that wants a pass gets
+            # one worker first, the remaining workers go to tables whose upstream tables are complete
+            wanted = OrderedDict()
+            for table in entries:
+                if state[table] == 'complete' or any(state[other] != 'complete' for other in hidden[table]):
+                    continue
+                complete_upstream = all(state[other] == 'complete' for other in foreign[table])
+                if complete_upstream and not final[table] and running[table] < processes:
+                    wanted[table] = (complete_upstream, processes - running[table])
+                elif not complete_upstream and running[table] == 0 and \
+                        time() - last_pass[table] >= REPOPULATE_INTERVAL:
+                    wanted[table] = (complete_upstream, 1)
+
+            free = processes - len(tasks)
+            assigned = OrderedDict((table, 0) for table in wanted)
+            for table in wanted:
+                if free > 0:
+                    assigned[table], free = 1, free - 1
+            while free > 0 and any(assigned[table] < n for table, (_, n) in wanted.items()):
+                for table, (_, n) in wanted.items():
+                    if free > 0 and assigned[table] < n:
+                        assigned[table], free = assigned[table] + 1, free - 1
+
+            for table, n in assigned.items():
+                if n == 0:
+                    continue
+                complete_upstream = wanted[table][0]
+                for _ in range(n):
+                    tasks.append((table, complete_upstream, pool.apply_async(populate_worker, entries[table])))
+                running[table] += n
+                last_pass[table] = time()
+                started.setdefault(table, time())
+                state[table] = 'running' if complete_upstream else 'streaming'
+
+            if time() - last_report >= PROGRESS_INTERVAL:
+                for table in entries:
+                    if state[table] != 'complete':
+                        counts[table] = rels[table].progress(display=False)
+                print_progress(time() - t0, state, counts, running, errors)
+                last_report = time()
+            sleep(POLL_INTERVAL)
+
+    print_progress(time() - t0, state, counts, running, errors)
+    return [dict(table=table, populated=counts[table][1] - counts[table][0] - initial[table],
+                 remaining=counts[table][0], total=counts[table][1],
+                 elapsed=finished[table] - started.get(table, finished[table]), errors=errors[table])
+            for table in entries]
+
+
+def reimport(processes=1):
+    """
+    Deletes the data of cells whose relacs files changed since the last run (see data.SourceFiles) and populates
+    the data pipeline again, which only imports the deleted cells.
+
+    :param processes: number of worker processes per table
+    :return: list of dictionaries returned by populate_table
+    """
+    from . import data
+    cells = data.SourceFiles().reset_changed()
+    print(len(cells), 'cells changed:', ', '.join(cells), flush=True)
+    return populate('data', processes=processes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='locking', description='Populate the efish locking pipeline.')
+    commands = parser.add_subparsers(dest='command')
+    cmd = commands.add_parser('populate', help='populate the tables of a pipeline')
+    cmd.add_argument('pipeline', choices=sorted(PIPELINES))
+    cmd.add_argument('-j', '--processes', type=int, default=multiprocessing.cpu_count(),
+                     help='number of worker processes per table (default: number of CPUs)')
+    cmd.add_argument('-t', '--tables', nargs='+', help='only populate these tables')
+    cmd.add_argument('-s', '--schedule', action='store_true',
+                     help='populate independent tables concurrently in one pool of PROCESSES workers')
+    cmd.add_argument('-p', '--profile', action='store_true',
+                     help='record time, memory, and transferred bytes of every key (see locking profile)')
+    cmd = commands.add_parser('reimport', help='re-import cells whose relacs files changed')
+    cmd.add_argument('-j', '--processes', type=int, default=multiprocessing.cpu_count(),
+                     help='number of worker processes per table (default: number of CPUs)')
+    cmd.add_argument('-y', '--yes', action='store_true', help='delete data of changed cells without asking')
+    cmd = commands.add_parser('cache', help='show the size of the local blob cache')
+    cmd.add_argument('--clear', action='store_true', help='remove all cached blobs')
+    cmd = commands.add_parser('profile', help='rank tables and keys recorded with populate --profile by time')
+    cmd.add_argument('-n', type=int, default=20, help='number of slowest keys to show (default: 20)')
+    cmd.add_argument('-t', '--table', help='only show keys of this table, e.g. efish_analyses.trial_align')
+    args = parser.parse_args(argv)
+
+    if args.command == 'populate':
+        if args.schedule:
+            stats = schedule(args.pipeline, processes=args.processes, tables=args.tables, profile=args.profile)
+            print_report(stats)
+        else:
+            stats = populate(args.pipeline, processes=args.processes, tables=args.tables, profile=args.profile)
+        return 1 if any(s['errors'] for s in stats) else 0
+    if args.command == 'reimport':
+        if args.yes:
+            import datajoint as dj
+            dj.config['safemode'] = False
+        stats = reimport(processes=args.processes)
+        return 1 if any(s['errors'] for s in stats) else 0
+    if args.command == 'cache':
+        from .blobcache import get_cache
+        cache = get_cache()
+        if args.clear:
+            cache.clear()
+        print('%s: %.1f of %.1f MB' % (cache.cachedir, cache.size() / 2 ** 20, cache.max_bytes / 2 ** 20))
+        return 0
+    if args.command == 'profile':
+        from . import profiling
+        restriction = None
+        if args.table is not None:
+            database, table = args.table.replace('`', '').split('.')
+            restriction = dict(table_name='`%s`.`%s`' % (database, table))
+        profiling.report(n=args.n, restriction=restriction)
+        return 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Opt-in profiling of populate. Tables that inherit from Profiled record wall time, CPU time, peak memory, and the
+bytes transferred from and to MySQL of every _make_tuples call in MakeProfile when their class attribute profile
+is True. The schema efish_profiling is only created when profiles are recorded or reported.
+
+Example::
+
+    analyses.FirstOrderSpikeSpectra.profile = True
+    analyses.FirstOrderSpikeSpectra().populate()
+    report()
+"""
+import resource
+from time import perf_counter, process_time
+
+import pandas as pd
+
+import datajoint as dj
+from datajoint.jobs import key_hash
+
+PROFILING_SCHEMA = 'efish_profiling'
+
+
+class MakeProfile(dj.Manual):
+    definition = """
+    # resources used by one _make_tuples call
+
+    table_name              : varchar(255)  # full name of the populated table
+    key_hash                : char(32)      # hash of the key like in the jobs tables
+    ---
+    key                     : longblob      # the populated key
+    wall_time               : double        # wall clock time in s
+    cpu_time                : double        # CPU time of the process in s
+    max_rss                 : bigint        # peak resident set size during the call in kB
+    bytes_fetched           : bigint        # bytes sent by the MySQL server during the call
+    bytes_inserted          : bigint        # bytes received by the MySQL server during the call
+    profiled_at=CURRENT_TIMESTAMP : timestamp # time of the call
+    """
+
+
+_schema = None
+
+
+def profile_table():
+    """
+    Declares MakeProfile in PROFILING_SCHEMA on first use, so that importing locking does not create the schema.
+
+    :return: MakeProfile()
+    """
+    global _schema
+    if _schema is None:
+        _schema = dj.schema(PROFILING_SCHEMA, dict(MakeProfile=MakeProfile))
+        _schema(MakeProfile)
+    return MakeProfile()
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size of the process, if the kernel supports it (Linux 4.0 and later).
+
+    :return: True if the peak was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as fid:
+            fid.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    :return: peak resident set size of the process in kB since the last reset_peak_rss, or since its start
+    """
+    try:
+        with open('/proc/self/status') as fid:
+            for line in fid:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def mysql_bytes(connection):
+    """
+    Bytes sent and received by the MySQL server in the current session.
+
+    :param connection: datajoint connection
+    :return: bytes sent (fetched by the client), bytes received (inserted by the client)
+    """
+    status = dict(connection.query("SHOW SESSION STATUS LIKE 'Bytes_%%'").fetchall())
+    return int(status['Bytes_sent']), int(status['Bytes_received'])
+
+
+class Profiled:
+    """
+    Mixin for dj.Computed and dj.Imported tables that records the resources of every _make_tuples call in
+    MakeProfile if the class attribute profile is True. The row is inserted in the transaction of the call,
+    so only keys that were populated successfully are recorded.
+
+    Profiled has to precede dj.Computed or dj.Imported in the bases, because it wraps populate.
+    """
+    profile = False
+
+    def populate(self, *restrictions, **kwargs):
+        if not self.profile:
+            return super().populate(*restrictions, **kwargs)
+
+        make_tuples = self._make_tuples
+        profiles = profile_table()
+
+        def profiled_make_tuples(key):
+            # without a reset of the peak, only an increase of the peak of the process is attributed to the call
+            rss = 0 if reset_peak_rss() else peak_rss()
+            sent, received = mysql_bytes(self.connection)
+            wall, cpu = perf_counter(), process_time()
+            make_tuples(key)
+            wall, cpu = perf_counter() - wall, process_time() - cpu
+            sent_after, received_after = mysql_bytes(self.connection)
+            profiles.insert1(dict(table_name=self.full_table_name, key_hash=key_hash(key), key=key,
+                                  wall_time=wall, cpu_time=cpu, max_rss=peak_rss() - rss,
+                                  bytes_fetched=sent_after - sent, bytes_inserted=received_after - received),
+                             replace=True)
+
+        self._make_tuples = profiled_make_tuples
+        try:
+            return super().populate(*restrictions, **kwargs)
+        finally:
+            del self._make_tuples
+
+
+def report(n=20, restriction=None):
+    """
+    Prints the resources per table, ranked by total wall time, and the n slowest keys.
+
+    :param n: number of keys to print
+    :param restriction: optional restriction on MakeProfile, e.g. a table name
+    :return: data frames with the summary per table and the slowest keys
+    """
+    rel = profile_table() & restriction if restriction is not None else profile_table()
+    df = pd.DataFrame(rel.fetch.as_dict())
+    if len(df) == 0:
+        print('No profiles recorded')
+        return None, None
+    df['table'] = df.table_name.str.replace('`', '')
+    df['mb_fetched'] = df.bytes_fetched / 2 ** 20
+    df['mb_inserted'] = df.bytes_inserted / 2 ** 20
+
+    g = df.groupby('table')
+    columns = ['keys', 'wall_total', 'wall_mean', 'wall_max', 'cpu_total', 'max_rss_kb', 'mb_fetched', 'mb_inserted']
+    tables = pd.DataFrame(dict(keys=g.size(), wall_total=g.wall_time.sum(), wall_mean=g.wall_time.mean(),
+                               wall_max=g.wall_time.max(), cpu_total=g.cpu_time.sum(), max_rss_kb=g.max_rss.max(),
+                               mb_fetched=g.mb_fetched.sum(), mb_inserted=g.mb_inserted.sum()))[columns]
+    tables = tables.sort_values('wall_total', ascending=False)
+    slowest = df.sort_values('wall_time', ascending=False).head(n)[
+        ['table', 'key', 'wall_time', 'cpu_time', 'max_rss', 'mb_fetched', 'mb_inserted']]
+
+    with pd.option_context('display.width', 200, 'display.max_colwidth', 80):
+        print(tables.round(3).to_string())
+        print('\n%i slowest keys' % n)
+        print(slowest.round(3).to_string(index=False))
+    return tables, slowest
@@ -0,0 +1,93 @@
+import hashlib
+import os
+import pickle
+import re
+from functools import lru_cache
+
+import yaml
+from pyrelacs.DataClasses import load as load_relacs, TraceFile
+
+from . import mkdir
+
+CACHEDIR = None  # directory for parsed relacs files on disk, set by locking.data; only the in-process cache if None
+CACHE_SIZE = 32  # number of parsed files kept in memory
+
+
+def parse_info(filename):
+    """
+    Parses the meta information in a relacs info.dat.
+
+    :param filename: path of the info.dat
+    :return: meta information as dictionary
+    """
+    info = open(filename).readlines()
+    info = [re.sub(r'[^\x00-\x7F]+', ' ', e[1:]) for e in info]
+    return yaml.load(''.join(info))
+
+
+PARSERS = {
+    'info': parse_info,
+    'relacs': load_relacs,
+    'trace': TraceFile,
+}
+
+
+def read_info(filename):
+    """
+    Cached version of parse_info.
+    """
+    return cached_parse('info', filename)
+
+
+def load(filename):
+    """
+    Cached version of pyrelacs.DataClasses.load, e.g. for stimuli.dat and spike files.
+    """
+    return cached_parse('relacs', filename)
+
+
+def load_tracefile(filename):
+    """
+    Cached version of pyrelacs.DataClasses.TraceFile.
+    """
+    return cached_parse('trace', filename)
+
+
+def cached_parse(kind, filename):
+    """
+    Parses a relacs file once per modification. Results are kept in an in-process LRU cache and, if CACHEDIR
+    is set, pickled to disk, so that all importers of a cell share one parse of each file. The cache key contains
+    modification time and size of the file, so changed files are parsed again.
+
+    The returned objects are shared between callers and must not be modified.
+
+    :param kind: one of the keys of PARSERS
+    :param filename: path of the file
+    :return: parsed file
+    """
+    stat = os.stat(filename)
+    return _parse(kind, os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse(kind, filename, mtime, size):
+    if CACHEDIR is None:
+        return PARSERS[kind](filename)
+
+    key = repr((kind, filename, mtime, size)).encode()
+    cachefile = os.path.join(CACHEDIR, hashlib.sha1(key).hexdigest() + '.pickle')
+    if os.path.isfile(cachefile):
+        with open(cachefile, 'rb') as fid:
+            return pickle.load(fid)
+
+    ret = PARSERS[kind](filename)
+    mkdir(CACHEDIR)
+    tmpfile = '%s.%i' % (cachefile, os.getpid())  # several importers may parse the same file at once
+    try:
+        with open(tmpfile, 'wb') as fid:
+            pickle.dump(ret, fid, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfile, cachefile)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        print('Could not cache', filename)
+        os.remove(tmpfile)
+    return ret
@@ -4,6 +4,9 @@ import datajoint as dj
 from datajoint import schema
 from locking.analyses import FirstOrderSignificantPeaks, SecondOrderSignificantPeaks
 from locking.data import Runs, LocalEODPeaksTroughs, GlobalEFieldPeaksTroughs
+from locking.critical_values import poisson_threshold
+from locking.profiling import Profiled
+from locking.seeds import key_seed, spawn_generators
 from scipy import stats
 import pycircstat as circ
 server = schema('efish_tests', locals())
@@ -13,7 +16,7 @@ TOL = 3
 
 
 @server
-class SpikeCheck(dj.Computed):
+class SpikeCheck(Profiled, dj.Computed):
     definition = """
     -> Runs
     ---
@@ -43,7 +46,7 @@ class SpikeCheck(dj.Computed):
 
 
 @server
-class PeakTroughCheck(dj.Computed):
+class PeakTroughCheck(Profiled, dj.Computed):
     definition = """
     ->Runs
 
@@ -208,7 +211,7 @@ class PowerParameters(dj.Lookup):
 
 
 @server
-class PowerAnalysis(dj.Computed):
+class PowerAnalysis(Profiled, dj.Computed):
     definition = """
     -> PowerParameters
     n           : int # number of trials
@@ -217,14 +220,7 @@ class PowerAnalysis(dj.Computed):
     """
 
     def compute_cutoff(self, poiss_rate, alpha, trials):
-        r = np.linspace(0, 2, 10000)
-        dr = r[1] - r[0]
-        mu = np.sum(2 * poiss_rate * r ** 2 * np.exp(poiss_rate * np.exp(-r ** 2) - poiss_rate - r ** 2) / (
-            1 - np.exp(-poiss_rate))) * dr
-        s = np.sum(2 * poiss_rate * r ** 3 * np.exp(poiss_rate * np.exp(-r ** 2) - poiss_rate - r ** 2) / (
-            1 - np.exp(-poiss_rate))) * dr
-        s2 = np.sqrt(s - mu ** 2.)
-        return stats.norm.ppf(1 - alpha, loc=mu, scale=s2 / np.sqrt(trials))
+        return poisson_threshold(poiss_rate, trials, alpha)
 
     def _make_tuples(self, key):
 
@@ -232,14 +228,16 @@ class PowerAnalysis(dj.Computed):
             (PowerParameters() & key).fetch1['repeats', 'poisson_rate','alpha','kappa']
         p = stats.poisson(poisson_rate)
         v = stats.vonmises(kappa)
-        for trials in range(2, 15):
+        seed = key_seed(self, key)
+        n_trials = range(2, 15)
+        for trials, rng in zip(n_trials, spawn_generators(seed, len(n_trials))):
             print('Trials', trials)
             cut_off = self.compute_cutoff(poisson_rate, alpha, trials)
             beta = []
             for r in range(repeats):
-                n = p.rvs(trials)
+                n = p.rvs(trials, random_state=rng)
 
-                vs = np.mean([circ.resultant_vector_length(v.rvs(m) % (2*np.pi)) for m in n])
+                vs = np.mean([circ.resultant_vector_length(v.rvs(m, random_state=rng) % (2*np.pi)) for m in n])
                 beta.append(vs < cut_off)
             self.insert1(dict(key, n=trials, power=1 - np.mean(beta)))
 
@@ -0,0 +1,59 @@
+"""
+Reproducible random streams for the simulations. Every populated key gets its own seed, derived from the table
+and the primary key, so the results do not depend on how many workers populate a table or which worker gets a
+key. The seed is not stored, since key_seed derives it again from the key to re-run a single key.
+
+Several independent streams of one key, e.g. for baseline and stimulus or for the tasks of a process pool, are
+spawned from the np.random.SeedSequence of the seed.
+
+Example::
+
+    seed = key_seed(self, key)
+    baseline_rng, stimulus_rng = spawn_generators(seed, 2)
+"""
+import hashlib
+
+import numpy as np
+from datajoint.jobs import key_hash
+
+
+def key_seed(table, key):
+    """
+    64 bit seed of a key, from the hash of the full table name and the key hash of the jobs tables.
+
+    :param table: table instance, whose primary key is taken from key, or a full table name
+    :param key: primary key
+    :return: seed as int
+    """
+    if isinstance(table, str):
+        name = table
+    else:
+        name = table.full_table_name
+        key = {k: key[k] for k in table.primary_key if k in key}
+    return int(hashlib.md5((name + key_hash(key)).encode()).hexdigest()[:16], 16)
+
+
+def seed_generator(seed):
+    """
+    :param seed: seed from key_seed
+    :return: np.random.Generator of the seed
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed))
+
+
+def spawn_seeds(seed, n):
+    """
+    :param seed: seed from key_seed
+    :param n: number of streams
+    :return: n independent np.random.SeedSequence children of the seed, e.g. to send to worker processes
+    """
+    return np.random.SeedSequence(seed).spawn(n)
+
+
+def spawn_generators(seed, n):
+    """
+    :param seed: seed from key_seed
+    :param n: number of streams
+    :return: n independent np.random.Generator spawned from the seed
+    """
+    return [np.random.default_rng(s) for s in spawn_seeds(seed, n)]
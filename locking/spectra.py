@@ -0,0 +1,225 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy import fft
+from pycircstat import event_series as es
+
+from .spiketrains import SpikeTrains
+
+SPECTRUM_MAX_ELEMENTS = 2 ** 21  # number of spike-frequency pairs evaluated at once by the chunked engine
+SECOND_ORDER_BATCH_SIZE = 16  # number of trials that are transformed at once by second_order_spectrum
+GAUSS_TRUNCATE = 8  # the Gaussian kernel of second_order_spectrum is cut off at GAUSS_TRUNCATE standard deviations
+
+
+def direct_spectrum(event_times, frequencies):
+    """
+    Vector strength spectrum as computed by pycircstat, one frequency at a time.
+
+    :param event_times: event times in s
+    :param frequencies: frequencies in Hz
+    :return: vector strength at the frequencies
+    """
+    return es.direct_vector_strength_spectrum(event_times, frequencies)
+
+
+def chunked_spectrum(event_times, frequencies, max_elements=None):
+    """
+    Exact vector strength spectrum, evaluated for blocks of frequencies at once. Memory is bounded by
+    max_elements complex numbers.
+
+    :param event_times: event times in s
+    :param frequencies: frequencies in Hz
+    :param max_elements: maximal number of spike-frequency pairs per block, SPECTRUM_MAX_ELEMENTS if None
+    :return: vector strength at the frequencies
+    """
+    max_elements = SPECTRUM_MAX_ELEMENTS if max_elements is None else max_elements
+    event_times = np.asarray(event_times, dtype=np.float64).ravel()
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    ret = np.empty(len(frequencies))
+    block = max(1, max_elements // max(len(event_times), 1))
+    for start in range(0, len(frequencies), block):
+        cycles = np.outer(frequencies[start:start + block], event_times)
+        cycles -= np.floor(cycles)  # phase in cycles, keeps the argument of exp small
+        ret[start:start + block] = np.abs(np.exp(2j * np.pi * cycles).mean(axis=1))
+    return ret
+
+
+def nufft_spectrum(event_times, frequencies, period=None, tol=1e-8, oversampling=2):
+    """
+    Vector strength spectrum on a regular frequency grid k / period with a type-1 non-uniform FFT.
+
+    The events are spread onto an oversampled regular grid with a Gaussian kernel, the grid is transformed
+    with an FFT, and the kernel is divided out (Greengard & Lee, 2004, SIAM Review 46(3)). The cost is
+    O(n_events * log(1 / tol) + n_grid * log(n_grid)) instead of O(n_events * n_frequencies), and the
+    absolute error of the vector strength is about tol.
+
+    :param event_times: event times in s
+    :param frequencies: frequencies in Hz, integer multiples of 1 / period like np.fft.fftfreq
+    :param period: inverse of the frequency resolution in s; inferred from the smallest non-zero |frequency|
+                   if None
+    :param tol: accuracy of the approximation
+    :param oversampling: ratio of grid size to the number of frequencies
+    :return: vector strength at the frequencies
+    """
+    event_times = np.asarray(event_times, dtype=np.float64).ravel()
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    n = len(event_times)
+    if period is None:
+        period = 1 / np.min(np.abs(frequencies[frequencies != 0]))
+    k = np.round(frequencies * period).astype(np.int64)
+    if not np.allclose(k / period, frequencies, rtol=1e-9, atol=1e-9):
+        raise ValueError('frequencies must be integer multiples of 1 / period')
+
+    # grid and width of the Gaussian kernel for the requested accuracy
+    modes = 2 * np.abs(k).max() + 1
+    m = int(oversampling * modes)
+    m += m % 2
+    spread = int(np.ceil(-np.log(tol) * (oversampling - .5) / (np.pi * (oversampling - 1)))) + 1
+    spread = min(spread, m // 2)
+    tau = np.pi * spread / (modes ** 2 * oversampling * (oversampling - .5))
+
+    # events as angles in [0, 2pi); exp(ikx) is unchanged for integer k
+    x = 2 * np.pi * ((event_times / period) % 1.)
+    h = 2 * np.pi / m
+    nearest = np.floor(x / h).astype(np.int64)
+    grid = np.zeros(m)
+    for offset in range(-spread + 1, spread + 1):
+        idx = nearest + offset
+        grid += np.bincount(idx % m, weights=np.exp(-(x - idx * h) ** 2 / (4 * tau)), minlength=m)
+
+    # sum_j exp(-ikx_j) from the FFT of the grid, with the Fourier transform of the kernel divided out
+    transform = np.fft.fft(grid)[k % m] * np.sqrt(np.pi / tau) * np.exp(k.astype(np.float64) ** 2 * tau) / m
+    return np.abs(transform) / n
+
+
+@lru_cache(maxsize=32)
+def fft_frequencies(n, sampling_rate, f_max):
+    """
+    Frequencies of np.fft.fftfreq(n, 1 / sampling_rate) with |f| <= f_max. The grid is memoized, so runs with the
+    same duration and sampling rate share one read-only array.
+
+    :param n: number of samples
+    :param sampling_rate: sampling rate in Hz
+    :param f_max: largest absolute frequency
+    :return: frequencies in Hz
+    """
+    f = np.fft.fftfreq(n, 1 / sampling_rate)
+    f = f[(f >= -f_max) & (f <= f_max)]
+    f.flags.writeable = False
+    return f
+
+
+SPECTRUM_ENGINES = {
+    'direct': direct_spectrum,
+    'chunked': chunked_spectrum,
+    'nufft': nufft_spectrum,
+}
+
+
+def vector_strength_spectrum(event_times, frequencies, engine='direct', **kwargs):
+    """
+    Vector strength spectrum of events with one of the engines in SPECTRUM_ENGINES. The value at frequency zero
+    is always computed by pycircstat, so that all engines agree on it.
+
+    :param event_times: event times in s
+    :param frequencies: frequencies in Hz
+    :param engine: 'direct', 'chunked', or 'nufft'
+    :param kwargs: options of the engine
+    :return: vector strength at the frequencies
+    """
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    if engine == 'direct':
+        return direct_spectrum(event_times, frequencies)
+    zero = frequencies == 0
+    ret = np.empty(len(frequencies))
+    ret[~zero] = SPECTRUM_ENGINES[engine](event_times, frequencies[~zero], **kwargs)
+    if np.any(zero):
+        ret[zero] = direct_spectrum(event_times, frequencies[:1] * 0)
+    return ret
+
+
+def mean_vector_strength(trains, frequencies, max_elements=None):
+    """
+    Vector strength of every trial at each frequency, averaged over trials. Equivalent to
+    np.mean([1 - circ.var((trial % (1. / f)) * f * 2 * np.pi) for trial in trains]) for each f, including the nan
+    of empty trials, but computed for all frequencies on the flat spike buffer at once.
+
+    :param trains: SpikeTrains
+    :param frequencies: frequencies in Hz
+    :param max_elements: maximal number of spike-frequency pairs per block, SPECTRUM_MAX_ELEMENTS if None
+    :return: mean vector strength at the frequencies
+    """
+    max_elements = SPECTRUM_MAX_ELEMENTS if max_elements is None else max_elements
+    frequencies = np.array(frequencies, dtype=np.float64, ndmin=1)
+    counts = trains.counts
+    nonempty = counts > 0
+    starts = trains.offsets[:-1][nonempty]
+
+    ret = np.empty(len(frequencies))
+    block = max(1, max_elements // max(len(trains.data), 1))
+    for start in range(0, len(frequencies), block):
+        f = frequencies[start:start + block]
+        r = np.full((len(f), len(trains)), np.nan)
+        if len(starts) > 0:
+            cycles = np.outer(f, trains.data)
+            cycles -= np.floor(cycles)
+            r[:, nonempty] = np.abs(np.add.reduceat(np.exp(2j * np.pi * cycles), starts, axis=1)) / counts[nonempty]
+        ret[start:start + block] = r.mean(axis=1) if len(trains) > 0 else np.nan
+    return ret
+
+
+def second_order_spectrum(trains, t, sampling_rate, f_max=None, dtype=np.float64, batch_size=None):
+    """
+    Mean over trials of the vector strength spectra computed by pycircstat.event_series.vector_strength_spectrum.
+
+    Instead of one full complex spectrum per trial, batches of trials are binned into a trials x time array,
+    transformed with a real FFT along time, truncated to f_max, and added to a running sum. The spikes are
+    convolved with the same Gaussian as in pycircstat, cut off at GAUSS_TRUNCATE standard deviations.
+
+    :param trains: SpikeTrains or list of spike time arrays in s
+    :param t: numpy.array of time points
+    :param sampling_rate: sampling rate in Hz
+    :param f_max: largest absolute frequency that is returned; all frequencies if None
+    :param dtype: np.float64 or np.float32; float32 bins and transforms each batch in single precision, which
+                  about halves the peak memory of a batch
+    :param batch_size: number of trials transformed at once, SECOND_ORDER_BATCH_SIZE if None
+    :return: frequencies with |f| <= f_max in the order of np.fft.fftfreq, mean vector strength spectrum
+    """
+    if not isinstance(trains, SpikeTrains):
+        trains = SpikeTrains.from_list(trains)
+    batch_size = SECOND_ORDER_BATCH_SIZE if batch_size is None else batch_size
+    t = np.asarray(t)
+    n, dt = len(t), 1. / sampling_rate
+    sigma = 1. / 2. / np.pi / sampling_rate * 8
+
+    w = np.fft.fftfreq(n, d=dt)
+    idx = np.ones(n, dtype=bool) if f_max is None else (w >= -f_max) & (w <= f_max)
+    w = w[idx]
+    k = np.flatnonzero(idx)
+    k = np.minimum(k, n - k)  # the spectrum of a real signal is symmetric
+    kmax = k.max() if len(k) > 0 else 0
+
+    radius = int(np.ceil(GAUSS_TRUNCATE * sigma / dt))
+    offsets = np.arange(-radius, radius + 1)
+    total = np.zeros(len(w))
+    counts = trains.counts
+    for start in range(0, len(trains), batch_size):
+        stop = min(start + batch_size, len(trains))
+        x = np.zeros((stop - start, n), dtype=dtype)
+        for i in range(stop - start):
+            spikes = trains[start + i]
+            # Gaussian around every spike evaluated at the closest grid points, binned one trial at a time so
+            # that only a single row is ever held in float64
+            m = np.rint((spikes - t[0]) / dt).astype(np.int64)[:, None] + offsets
+            valid = (m >= 0) & (m < n)
+            m = np.clip(m, 0, n - 1)
+            values = np.exp(-(t[m] - spikes[:, None]) ** 2 / (2 * sigma ** 2)) / (sigma * np.sqrt(2 * np.pi))
+            x[i] = np.bincount(m[valid], weights=values[valid], minlength=n)
+
+        a = np.abs(fft.rfft(x, axis=1)[:, :kmax + 1])[:, k]  # scipy keeps float32 in single precision
+        with np.errstate(divide='ignore', invalid='ignore'):  # empty trials give nan like in pycircstat
+            total += (a * (dt / counts[start:stop])[:, None]).sum(axis=0)
+
+    a = total / len(trains)
+    a[w == 0] = np.nan
+    return w, a / np.exp(-2 * np.pi ** 2 * sigma ** 2 * w ** 2)
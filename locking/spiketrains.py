@@ -0,0 +1,104 @@
+import numpy as np
+
+
+class SpikeTrains:
+    """
+    Spike trains of several trials in one flat float64 buffer. Trial i consists of
+    data[offsets[i]:offsets[i + 1]], like the rows of a CSR matrix.
+
+    Iterating over SpikeTrains or indexing it with an integer returns views into the buffer, so it can be used
+    wherever a list of per-trial arrays was used before. Unit conversion, alignment, and folding are vectorized
+    over all trials and return new SpikeTrains.
+
+    Example::
+
+        spikes = SpikeTrains.from_list(times).to_seconds().align(t0)
+        aggregated = spikes.fold(1 / eod).data
+    """
+
+    def __init__(self, data, offsets):
+        self.data = np.asarray(data, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_list(cls, trains):
+        """
+        Copies a list of per-trial spike time arrays into one buffer.
+
+        :param trains: iterable of arrays of spike times
+        :return: SpikeTrains
+        """
+        trains = [np.ravel(t) for t in trains]
+        offsets = np.zeros(len(trains) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in trains], out=offsets[1:])
+        data = np.concatenate(trains) if len(trains) > 0 else np.zeros(0)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('trial index out of range')
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for start, stop in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.data[start:stop]
+
+    def __repr__(self):
+        return 'SpikeTrains(%i trials, %i spikes)' % (len(self), len(self.data))
+
+    @property
+    def counts(self):
+        """
+        Number of spikes per trial.
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def trial_index(self):
+        """
+        Trial index of every spike in data.
+        """
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def tolist(self):
+        return list(self)
+
+    def to_seconds(self):
+        """
+        Converts spike times from ms to s.
+        """
+        return SpikeTrains(self.data / 1000, self.offsets)
+
+    def align(self, t0):
+        """
+        Subtracts an alignment time from every trial.
+
+        :param t0: one time per trial, or a single time for all trials
+        """
+        t0 = np.asarray(t0, dtype=np.float64)
+        if t0.ndim > 0:
+            t0 = np.repeat(t0, self.counts)
+        return SpikeTrains(self.data - t0, self.offsets)
+
+    def intervals(self):
+        """
+        Interspike intervals within every trial.
+        """
+        d = np.diff(self.data)
+        boundaries = self.offsets[1:-1]
+        keep = np.ones(len(d), dtype=bool)
+        keep[boundaries[(boundaries > 0) & (boundaries < len(self.data))] - 1] = False
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(np.maximum(self.counts - 1, 0), out=offsets[1:])
+        return SpikeTrains(d[keep], offsets)
+
+    def fold(self, period):
+        """
+        Spike times modulo period, e.g. the phase of the spikes within an EOD cycle in s.
+        """
+        return SpikeTrains(self.data % period, self.offsets)
@@ -0,0 +1,81 @@
+import re
+from functools import lru_cache
+
+# units relacs writes into its metadata; min is converted to s like in the pint code path
+FAST_UNITS = {'ms': ('ms', 1), 's': ('s', 1), 'min': ('s', 60), 'Hz': ('Hz', 1), 'kHz': ('kHz', 1),
+              'mV': ('mV', 1), 'V': ('V', 1)}
+TIME_SCALES = {'ms': 1, 's': 1000, 'min': 60000}  # in ms, integers so that ratios are exact
+
+NUMBER_AND_UNIT = re.compile(r'^\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([A-Za-z]+)\s*$')
+INTEGER = re.compile(r'^[-+]?\d+$')
+
+
+@lru_cache(maxsize=1)
+def unit_registry():
+    """
+    Pint unit registry, created on first use because importing and setting up pint is slow.
+    """
+    from pint import UnitRegistry
+    return UnitRegistry()
+
+
+@lru_cache(maxsize=1024)
+def get_number_and_unit(value_string):
+    """
+    Get the number and the unit from a string.
+
+    Strings of the form <number><unit> with one of the units in FAST_UNITS are parsed with a regular expression,
+    everything else with pint. Results are memoized.
+
+    :param value_string: string with number and unit
+    :return: value, unit
+    """
+    if value_string.endswith('%'):
+        return (float(value_string.strip()[:-1]), '%')
+
+    match = NUMBER_AND_UNIT.match(value_string)
+    if match is not None and match.group(2) in FAST_UNITS:
+        number, unit = match.groups()
+        value = int(number) if INTEGER.match(number) else float(number)
+        unit, scale = FAST_UNITS[unit]
+        return (value * scale, unit)
+
+    try:
+        a = unit_registry().parse_expression(value_string)
+    except:
+        return (value_string, None)
+
+    if type(a) == list:
+        return (value_string, None)
+
+    if isinstance(a, (int, float)):
+        return (a, None)
+    else:
+        # a.ito_base_units()
+        value = a.magnitude
+        unit = "{:~}".format(a)
+        unit = unit[unit.index(" "):].replace(" ", "")
+
+        if unit == 'min':
+            unit = 's'
+            value *= 60
+        return (value, unit)
+
+
+@lru_cache(maxsize=1024)
+def convert_to(value_string, unit):
+    """
+    Converts a string with number and unit to a number in another unit, e.g. convert_to('1s', 'ms') == 1000.
+
+    Time units are converted without pint if the target unit divides the source unit, e.g. s to ms, so that the
+    factor is an exact integer like in pint. All other conversions go through pint.
+
+    :param value_string: string with number and unit
+    :param unit: target unit
+    :return: magnitude in the target unit
+    """
+    match = NUMBER_AND_UNIT.match(value_string)
+    if match is not None and match.group(2) in TIME_SCALES and unit in TIME_SCALES \
+            and TIME_SCALES[match.group(2)] % TIME_SCALES[unit] == 0:
+        return float(match.group(1)) * (TIME_SCALES[match.group(2)] // TIME_SCALES[unit])
+    return unit_registry().parse_expression(value_string).to(unit).magnitude
@@ -0,0 +1,74 @@
+from time import time
+
+import numpy as np
+from scipy.integrate import odeint
+
+from locking.lif import lif, punit_drive
+
+# parameters of LIFPUnit 'nwgimproved' at an EOD frequency of 800 Hz
+ZETA, TAU, GAIN, OFFSET, NOISE_SD, THRESHOLD, RESET, LIF_TAU = 0.2, 0.002, 70, 9, 30, 14., 0., 0.001
+EOD = 800.
+
+
+def eod(t, f=EOD, harmonics=((1., 0.), (.3, .2), (.1, -.05))):
+    """
+    EOD like waveform with a few harmonics.
+    """
+    return sum(s * np.sin(2 * np.pi * (i + 1) * f * t) + c * np.cos(2 * np.pi * (i + 1) * f * t)
+               for i, (s, c) in enumerate(harmonics))
+
+
+def odeint_drive(stimulus, t, zeta, w0, gain, alpha, tau):
+    """
+    Input of the LIF as computed by the odeint engine of LIFPUnit.simulate.
+    """
+    def _d(y, tt):
+        return np.array([y[1], stimulus(tt) - 2 * zeta * w0 * y[1] - w0 ** 2 * y[0],
+                         (-y[2] + gain * alpha * max(y[0], 0)) / tau])
+
+    return odeint(_d, np.zeros(3), t).T[2]
+
+
+def loop_lif(v_in, t, n, tau, threshold, reset, noise_sd, rng):
+    """
+    LIF as simulated by the odeint engine of LIFPUnit.simulate.
+    """
+    dt = t[1] - t[0]
+    v = np.zeros(n)
+    ret = [list() for _ in range(n)]
+    for i, T in enumerate(t):
+        v += (-v + v_in[i]) * dt / tau + rng.standard_normal(n) * np.sqrt(dt) * noise_sd
+        idx = v > threshold
+        for j in np.where(idx)[0]:
+            ret[j].append(T)
+        v[idx] = reset
+    return tuple(np.asarray(e) for e in ret)
+
+
+if __name__ == '__main__':
+    dt, n = 5e-6, 50
+    wr = 2 * np.pi * EOD
+    w0 = wr / np.sqrt(1 - 2 * ZETA ** 2)
+    alpha = wr * np.sqrt((2 * w0 * ZETA) ** 2 + (wr ** 2 - w0 ** 2) ** 2 / wr ** 2)
+    stimulus = lambda tt: eod(tt) + .2 * eod(tt, EOD + 37)
+
+    for duration in [.2, 1]:
+        t = np.arange(0, duration, dt)
+        t0 = time()
+        ref = odeint_drive(stimulus, t, ZETA, w0, GAIN, alpha, TAU) - OFFSET
+        t1 = time()
+        v_in = punit_drive(stimulus(t), dt, ZETA, w0, GAIN, alpha, TAU) - OFFSET
+        t2 = time()
+        print('{:>4.1f} s, {:7d} steps: drive odeint {:7.3f} s, lfilter {:7.3f} s (x{:6.1f}), max. abs. error {:.1e} '
+              'of range {:.1f}'.format(duration, len(t), t1 - t0, t2 - t1, (t1 - t0) / (t2 - t1),
+                                       np.max(np.abs(v_in - ref)), np.ptp(ref)))
+
+        t0 = time()
+        spikes_ref = loop_lif(ref, t, n, LIF_TAU, THRESHOLD, RESET, NOISE_SD, np.random.default_rng(0))
+        t1 = time()
+        spikes = lif(ref, t, n, LIF_TAU, THRESHOLD, RESET, NOISE_SD, rng=np.random.default_rng(0))
+        t2 = time()
+        same = sum(np.array_equal(a, b) for a, b in zip(spikes_ref, spikes))
+        print('{:>25s} LIF loop {:7.3f} s, block {:7.3f} s (x{:6.1f}), {:d}/{:d} identical trials, '
+              '{:.2e} trial steps/s'.format('', t1 - t0, t2 - t1, (t1 - t0) / (t2 - t1), same, n,
+                                             n * len(t) / (t2 - t1)))
@@ -0,0 +1,107 @@
+import sys
+import tempfile
+from time import time
+
+import numpy as np
+
+from locking.peaks import peakdet, PeakDetector, default_delta
+
+
+def peakdet_loop(v, delta=None):
+    """
+    Sample-wise reference implementation of locking.peaks.peakdet.
+    """
+    maxtab = []
+    maxidx = []
+
+    mintab = []
+    minidx = []
+    v = np.asarray(v)
+    if delta is None:
+        up = int(np.min([1e5, len(v)]))
+        tmp = np.abs(v[:up])
+        delta = np.percentile(tmp, 99.9) - np.percentile(tmp, 50)
+
+    if not np.isscalar(delta):
+        sys.exit('Input argument delta must be a scalar')
+
+    if delta <= 0:
+        sys.exit('Input argument delta must be positive')
+
+    mn, mx = np.inf, -np.inf
+    mnpos, mxpos = np.nan, np.nan
+
+    lookformax = True
+    for i in range(len(v)):
+        this = v[i]
+        if this > mx:
+            mx = this
+            mxpos = i
+
+        if this < mn:
+            mn = this
+            mnpos = i
+
+        if lookformax:
+            if this < mx - delta:
+                maxtab.append(mx)
+                maxidx.append(mxpos)
+                mn = this
+                mnpos = i
+                lookformax = False
+
+        else:
+            if this > mn + delta:
+                mintab.append(mn)
+                minidx.append(mnpos)
+                mx = this
+                mxpos = i
+                lookformax = True
+
+    return np.asarray(maxtab), np.asarray(maxidx, dtype=int), np.asarray(mintab), np.asarray(minidx, dtype=int)
+
+
+def eod_trace(duration, samplingrate, eod=800., delta_f=50., noise=0.05, seed=0):
+    """
+    Synthetic float32 EOD + stimulus trace with three harmonics and additive noise.
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(0, duration, 1 / samplingrate)
+    x = sum(np.sin(2 * np.pi * k * eod * t) / k for k in range(1, 4)) \
+        + 0.2 * np.sin(2 * np.pi * (eod + delta_f) * t) + noise * rng.randn(len(t))
+    return x.astype(np.float32)
+
+
+def timeit(f, *args, repeats=3):
+    best = np.inf
+    for _ in range(repeats):
+        t0 = time()
+        f(*args)
+        best = min(best, time() - t0)
+    return best
+
+
+if __name__ == '__main__':
+    samplingrate = 20000.
+    for duration, noise in [(1, 0.), (1, 0.05), (10, 0.05), (10, 0.5)]:
+        x = eod_trace(duration, samplingrate, noise=noise)
+        ref = peakdet_loop(x)
+        new = peakdet(x)
+        for a, b in zip(ref, new):
+            assert np.array_equal(a, b), 'peakdet deviates from reference implementation'
+        for a, b in zip(new, peakdet(x, chunk_size=1000)):
+            assert np.array_equal(a, b), 'peakdet depends on chunk size'
+
+        # stream a memory-mapped relacs-like raw file through a PeakDetector in blocks of odd size
+        with tempfile.NamedTemporaryFile(suffix='.raw') as fid:
+            x.tofile(fid.name)
+            trace = np.memmap(fid.name, dtype=np.float32, mode='r')
+            detector = PeakDetector(default_delta(trace))
+            streamed = [detector.update(trace[i:i + 12345]) for i in range(0, len(trace), 12345)]
+            for a, b in zip(new, zip(*streamed)):
+                assert np.array_equal(a, np.hstack(b)), 'streaming peak detection deviates'
+
+        t_ref = timeit(peakdet_loop, x)
+        t_new = timeit(peakdet, x)
+        print('{:>8d} samples, noise {:.2f}, {:5d} peaks: loop {:10.0f} samples/s, vectorized {:12.0f} samples/s '
+              '(x{:.1f})'.format(len(x), noise, len(new[1]), len(x) / t_ref, len(x) / t_new, t_ref / t_new))
@@ -0,0 +1,49 @@
+from time import time
+
+import numpy as np
+
+from locking.spectra import vector_strength_spectrum
+
+
+def locked_spikes(duration, rate=100., eod=800., n_trials=10, jitter=1e-4, p_locked=.3, seed=0):
+    """
+    Aggregated spikes of several trials: Poisson background plus spikes locked to the EOD with some jitter.
+    """
+    rng = np.random.RandomState(seed)
+    spikes = []
+    for _ in range(n_trials):
+        spikes.append(rng.uniform(0, duration, rng.poisson(rate * duration)))
+        cycles = np.arange(0, duration, 1 / eod)
+        locked = cycles[rng.rand(len(cycles)) < p_locked]
+        spikes.append(locked + jitter * rng.randn(len(locked)))
+    return np.hstack(spikes)
+
+
+def timeit(f, *args, repeats=3, **kwargs):
+    best = np.inf
+    for _ in range(repeats):
+        t0 = time()
+        ret = f(*args, **kwargs)
+        best = min(best, time() - t0)
+    return best, ret
+
+
+if __name__ == '__main__':
+    samplingrate, f_max = 20000., 2000
+    for duration in [1, 10]:
+        n = int(duration * samplingrate)
+        f = np.fft.fftfreq(n, 1 / samplingrate)
+        f = f[(f >= -f_max) & (f <= f_max)]
+        spikes = locked_spikes(duration)
+
+        t_ref, ref = timeit(vector_strength_spectrum, spikes, f, 'direct', repeats=1)
+        print('{:>3d} s, {:6d} spikes, {:6d} frequencies: direct {:8.3f} s'.format(duration, len(spikes), len(f), t_ref))
+        runs = [('chunked', {}), ('nufft', dict(tol=1e-4)), ('nufft', dict(tol=1e-8)), ('nufft', dict(tol=1e-12))]
+        for engine, options in runs:
+            if engine == 'nufft':
+                options['period'] = n / samplingrate
+            t, v = timeit(vector_strength_spectrum, spikes, f, engine, **options)
+            assert np.array_equal(np.isnan(v), np.isnan(ref)), 'engines disagree on undefined values'
+            err = np.nanmax(np.abs(v - ref))
+            print('{:>34s} {:8.3f} s (x{:7.1f}), max. abs. error {:.1e}'.format(
+                engine + ('' if 'tol' not in options else ' tol={:.0e}'.format(options['tol'])), t, t_ref / t, err))
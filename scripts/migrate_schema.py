@@ -0,0 +1,10 @@
+from locking import analyses, modelling
+
+# Adds the attributes that were introduced after the tables were declared, e.g.
+#
+#   python migrate_schema.py
+#
+# Run once after updating the code on an existing database; tables that are already up to date are left unchanged.
+
+analyses.migrate_spectra_parameters()
+modelling.migrate_punit_simulations()
@@ -0,0 +1,15 @@
+import sys
+
+from locking import data
+
+# Moves the trial traces of the given part tables of Runs out of the database, e.g.
+#
+#   python migrate_traces.py GlobalEField LocalEOD
+#
+# Without arguments all trace tables are migrated. Trials imported afterwards are stored as file
+# references as well, as long as TRACE_STORAGE is set to 'file' for their table.
+
+parts = sys.argv[1:] if len(sys.argv) > 1 else list(data.TRACE_STORAGE)
+for name in parts:
+    data.TRACE_STORAGE[name] = 'file'
+    data.migrate_traces(getattr(data.Runs, name)())
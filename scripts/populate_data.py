@@ -6,6 +6,7 @@ data.Cells().populate(reserve_jobs=True)
 data.FICurves().populate(reserve_jobs=True)
 data.ISIHistograms().populate(reserve_jobs=True)
 data.Baseline().populate(reserve_jobs=True)
+data.Runs.extract_peaks = True  # fills the *PeaksTroughs tables during import
 data.Runs().populate(reserve_jobs=True)
 data.GlobalEFieldPeaksTroughs().populate(reserve_jobs=True)
 data.GlobalEODPeaksTroughs().populate(reserve_jobs=True)
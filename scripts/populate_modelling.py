@@ -4,6 +4,8 @@ print('Populating EODFit')
 mod.EODFit().populate(reserve_jobs=True)
 print('Populating LIFPUnit')
 mod.LIFPUnit().populate(reserve_jobs=True)
+print('Populating LIFSweepSummary')
+mod.LIFSweepSummary().populate(reserve_jobs=True)
 print('Populating PUnitSimulations')
 mod.PUnitSimulations().populate(reserve_jobs=True)
 print('Populating PyramidalLIF')
@@ -30,6 +30,7 @@ setup(
         'License :: OSI Approved :: Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License',
         'Topic :: Analysis :: Reproducibility',
     ],
-    scripts=['scripts/{0}'.format(basename(file)) for file in glob('scripts/*.py')]
+    scripts=['scripts/{0}'.format(basename(file)) for file in glob('scripts/*.py')],
+    entry_points={'console_scripts': ['locking=locking.populate:main']},
 
 )